@@ -15,7 +15,7 @@ function SearchNotes({ folders, onSearchResults, onClearSearch }) {
 
     try {
       // Build the search URL
-      let url = `/api/notes/search?q=${encodeURIComponent(searchQuery)}`;
+      let url = `/api/notes/search?q=${encodeURIComponent(searchQuery)}&fields=title,preview,tags,updated_at`;
       if (selectedFolder) {
         url += `&folder_id=${selectedFolder}`;
       }
@@ -82,7 +82,8 @@ function Dashboard() {
   // Load notes (all or by folder)
   const loadNotes = async () => {
     try {
-      let url = '/api/notes?limit=20';
+      // The cards only need a preview, the full content is fetched when a note is opened
+      let url = '/api/notes?limit=20&fields=title,preview,tags,updated_at';
       if (selectedFolder) {
         url += `&folder_id=${selectedFolder}`;
       }
@@ -126,8 +127,15 @@ function Dashboard() {
   };
 
   // When user clicks on a note to edit
-  const handleNoteClick = (note) => {
-    setEditingNote(note);
+  const handleNoteClick = async (note) => {
+    try {
+      const response = await fetch(`/api/notes/${note.id}`);
+      if (response.ok) {
+        setEditingNote(await response.json());
+      }
+    } catch (err) {
+      setError('Failed to load note');
+    }
   };
 
   // When note is updated or deleted
@@ -283,9 +291,7 @@ function Dashboard() {
                       className="note-card"
                     >
                       <h3>{note.title}</h3>
-                      <p>
-                        {note.content?.substring(0, 100)}{note.content?.length > 100 ? '...' : ''}
-                      </p>
+                      <p>{note.preview}</p>
                       <p className="note-date">
                         {new Date(note.updated_at).toLocaleDateString()}
                       </p>
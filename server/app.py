@@ -1,9 +1,28 @@
-from flask import Flask, request, session, jsonify
+from flask import Flask, Response, request, g, jsonify, stream_with_context
 from flask_migrate import Migrate
 from flask_restful import Resource, Api
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import defer
+from sqlalchemy.orm.exc import StaleDataError
 from config import db, bcrypt
-from models import User, Folder, Note, Tag, NoteTag
+from models import User, Folder, Note, Tag, NoteTag, Change, NOTE_FIELDS
+from search import fts_search
+from exporter import export_notes, ndjson_lines, gzip_chunks
+from importer import import_notes, iter_ndjson, iter_markdown_zip, ImportFailed
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+from edits import apply_edits, parse_line_range, InvalidEdit
+from commands import register_commands
+from hashing import init_hashing, HashingBusy
+from auth import init_auth, login_required, log_in, log_out, revoke_sessions, invalidate_identity, identity_cache
+from instrumentation import init_instrumentation, metrics
+from compression import init_compression
+from responses import init_responses
+from caching import (
+    etag_by_data_version, init_cache, user_cache, user_folders, user_tags, owns_folder, owns_tag,
+    invalidate_user_folders, invalidate_user_tags
+)
 import traceback
+import zipfile
 from flask_cors import CORS
 import os
 
@@ -12,12 +31,44 @@ app = Flask(__name__)
 CORS(app)
 
 app.config['SECRET_KEY'] = 'TEST'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///notes.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///notes.db')
+# In process cache of each user's folders and tags
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 30))
+app.config['NOTES_BATCH_MAX_SIZE'] = int(os.environ.get('NOTES_BATCH_MAX_SIZE', 500))
+# Password hashing cost and the thread pool it runs on
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', 0)) or None
+app.config['HASH_QUEUE_DEPTH'] = int(os.environ.get('HASH_QUEUE_DEPTH', 16))
+# How long a user's identity is trusted before the session is checked against the db again
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 30))
+# Note content at least this many bytes long is stored compressed, 0 turns compression off
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# Responses at least this big are gzip or brotli compressed when the client accepts it
+app.config['RESPONSE_COMPRESS_MIN_SIZE'] = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', 1024))
+app.config['RESPONSE_COMPRESS_LEVEL'] = int(os.environ.get('RESPONSE_COMPRESS_LEVEL', 6))
+# Adds a Server-Timing header with app and database time to every response
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true')
+# Development aid: 'log' or 'raise' when a request repeats one query shape more than
+# QUERY_REPEAT_LIMIT times (an N+1) or a single query takes over SLOW_QUERY_MS
+app.config['QUERY_WATCH'] = os.environ.get('QUERY_WATCH', 'off').lower()
+app.config['QUERY_REPEAT_LIMIT'] = int(os.environ.get('QUERY_REPEAT_LIMIT', 10))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
 
 db.init_app(app)
 bcrypt.init_app(app)
 migrate = Migrate(app, db)
 api = Api(app)
+# Instrumentation goes first so its timers wrap every other hook
+init_instrumentation(app)
+init_responses(app, api)
+register_commands(app)
+init_cache(app)
+init_hashing(app)
+init_compression(app)
+init_auth(app)
+metrics.add_cache('user', user_cache)
+metrics.add_cache('identity', identity_cache)
 
 @app.route('/signup', methods=['POST'])
 def signup():
@@ -46,10 +97,13 @@ def signup():
         db.session.add(new_user)
         db.session.commit()
 
-        session['user_id'] = new_user.id
+        log_in(new_user)
         
         return jsonify(new_user.to_dict()), 201
     
+    except HashingBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except ValueError as e:
         return jsonify({'error': str(e)}), 422
     except Exception as e:
@@ -72,46 +126,106 @@ def login():
 
         if not user or not user.authenticate(password):
             return jsonify({'error': 'Invalid username or password'}), 401
+
+        # Upgrade old hashes when the configured bcrypt cost changes
+        if user.password_needs_rehash():
+            user.password_hash = password
+            db.session.commit()
         
-        session['user_id'] = user.id
+        log_in(user)
 
         return jsonify(user.to_dict())
     
+    except HashingBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 401
     
 @app.route('/check_session', methods=['GET'])
 def check_session():
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
-        if user: 
-            return jsonify(user.to_dict()), 200
+    # The session was already validated against the identity cache
+    if g.user_id:
+        return jsonify({'id': g.user_id, 'username': g.username}), 200
     
     return jsonify({}), 401
 
 @app.route('/logout', methods=['DELETE'])
 def logout():
-    if 'user_id' not in session:
+    if not g.user_id:
         return jsonify({'error': 'No active session'}), 401
-    session.pop('user_id', None)
+
+    # ?everywhere=true also ends the user's sessions on other devices
+    if request.args.get('everywhere', 'false').lower() in ('1', 'true'):
+        revoke_sessions(g.user_id)
+        db.session.commit()
+        invalidate_identity(g.user_id)
+
+    log_out()
     return jsonify({}), 200
 
+def requested_note_fields():
+    """Parse ?fields=title,preview into a tuple of note fields, None means all of them"""
+    value = request.args.get('fields')
+    if not value:
+        return None
+
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = sorted(fields.difference(NOTE_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # The id always comes back so the client can fetch the rest of the note
+    return tuple(field for field in NOTE_FIELDS if field == 'id' or field in fields)
+
+
+def load_note_fields(query, fields):
+    # Note bodies can be large, only read them from disk when they are sent
+    if fields and 'content' not in fields:
+        query = query.options(defer(Note.content))
+    return query
+
+
+def owned_by_id(query, model, user_id, ids):
+    """The rows of query with these ids that belong to the user.
+
+    Looked up by primary key alone and checked in Python. With user_id in the
+    WHERE clause SQLite walks the user's index, so the cost would grow with the
+    size of the account instead of with the number of ids.
+    """
+    if not ids:
+        return []
+    return [row for row in query.filter(model.id.in_(ids)) if row.user_id == user_id]
+
+
+def note_etag(note):
+    # Changes with every saved write, thanks to the version counter
+    return f'{note.id}-{note.version}'
+
+
 class NotesList(Resource):
+    method_decorators = [login_required]
+
+    @etag_by_data_version
     def get(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
 
         # Pagination so that more notes will load on scroll
         limit = request.args.get('limit', 10, type=int)
         offset = request.args.get('offset', 0, type=int)
         folder_id = request.args.get('folder_id', type=int)
+        try:
+            fields = requested_note_fields()
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
-        query = Note.query.filter_by(user_id=user_id)
+        query = load_note_fields(Note.query.filter_by(user_id=user_id), fields)
         if folder_id:
             query = query.filter_by(folder_id=folder_id)
 
+        # Cursor mode is used when a cursor is passed (empty for the first page)
+        if 'cursor' in request.args:
+            return self.get_page_after_cursor(query, limit, fields)
+
         query = query.order_by(Note.updated_at.desc())
 
         total = query.count()
@@ -121,7 +235,7 @@ class NotesList(Resource):
         has_more = (offset + limit) < total
 
         return {
-            'notes': [note.to_dict() for note in notes],
+            'notes': Note.to_dict_list(notes, fields),
             'pagination': {
                 'limit': limit,
                 'offset': offset,
@@ -130,11 +244,55 @@ class NotesList(Resource):
                 'next_offset': offset + limit if has_more else None
             }
         }, 200
+
+    def get_page_after_cursor(self, query, limit, fields=None):
+        # Keyset pagination on (updated_at, id). Compare the stored timestamp
+        # text directly so the cursor matches the exact value in the row.
+        updated_key = db.type_coerce(Note.updated_at, db.String)
+        include_total = request.args.get('include_total', 'false').lower() in ('1', 'true')
+        cursor = request.args.get('cursor', '')
+
+        if limit < 1:
+            return {'error': 'Limit must be at least 1'}, 400
+
+        total = query.count() if include_total else None
+
+        if cursor:
+            try:
+                last_updated, last_id = decode_cursor(cursor, (str, int))
+            except InvalidCursor as e:
+                return {'error': str(e)}, 400
+            query = query.filter(db.tuple_(updated_key, Note.id) < db.tuple_(last_updated, last_id))
+
+        # Grab one extra row to know if there is another page
+        rows = (
+            query.add_columns(updated_key)
+            .order_by(Note.updated_at.desc(), Note.id.desc())
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        notes = [note for note, _ in rows]
+
+        next_cursor = None
+        if has_more:
+            last_updated = rows[-1][1]
+            next_cursor = encode_cursor(last_updated, notes[-1].id)
+
+        return {
+            'notes': Note.to_dict_list(notes, fields),
+            'pagination': {
+                'limit': limit,
+                'total': total,
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }
+        }, 200
     
     def post(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         try:
             data = request.get_json()
@@ -151,8 +309,7 @@ class NotesList(Resource):
             if not folder_id:
                 return {'error': 'Folder id is required'}, 400
             
-            folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
-            if not folder:
+            if not owns_folder(user_id, folder_id):
                 return {'error': 'Folder not found'}, 404
             
             new_note = Note(
@@ -163,32 +320,37 @@ class NotesList(Resource):
             )
 
             db.session.add(new_note)
+            User.bump_data_version(user_id)
             db.session.commit()
+            # The folder's note count changed
+            invalidate_user_folders(user_id)
 
             return new_note.to_dict(), 201
         
+        except ValueError as e:
+            db.session.rollback()
+            return {'error': str(e)}, 422
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
         
 class NotesDetail(Resource):
+    method_decorators = [login_required]
+
     def get(self, note_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         # Get specific note from user
         note = Note.query.filter_by(id=note_id, user_id=user_id).first()
         if not note:
             return {'error': 'Note not found'}, 404
         
-        return note.to_dict(), 200
+        return note.to_dict(), 200, {'ETag': f'"{note_etag(note)}"'}
     
     # Ability to edit notes
+    # Send If-Match: "<id>-<version>" or expected_version to refuse overwriting a newer save
     def put(self, note_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         note = Note.query.filter_by(id=note_id, user_id=user_id).first()
         if not note:
@@ -198,28 +360,89 @@ class NotesDetail(Resource):
             data = request.get_json()
             if not data:
                 return {'error': 'No data provided'}, 400
-            
+
+            expected_version = data.get('expected_version')
+            if expected_version is not None and not isinstance(expected_version, int):
+                return {'error': 'expected_version must be an integer'}, 400
+            if request.if_match and not request.if_match.contains(note_etag(note)):
+                return {'error': 'Note was changed since it was loaded', 'version': note.version}, 409
+            if expected_version is not None and expected_version != note.version:
+                return {'error': 'Note was changed since it was loaded', 'version': note.version}, 409
+
+            changes = {
+                field: data[field] for field in ('title', 'content', 'folder_id')
+                if field in data and data[field] != getattr(note, field)
+            }
+            # Autosave of an unchanged note: no write, updated_at and the feed order stay put
+            if not changes:
+                return note.to_dict(), 200, {'ETag': f'"{note_etag(note)}"'}
+
+            if 'folder_id' in changes and not owns_folder(user_id, changes['folder_id']):
+                return {'error': 'Folder not found'}, 404
+            for field, value in changes.items():
+                setattr(note, field, value)
+
+            User.bump_data_version(user_id)
+            db.session.commit()
+            if 'folder_id' in changes:
+                invalidate_user_folders(user_id)
+            return note.to_dict(), 200, {'ETag': f'"{note_etag(note)}"'}
+
+        except StaleDataError:
+            # Another write got in between loading the note and saving it
+            db.session.rollback()
+            return {'error': 'Note was changed since it was loaded'}, 409
+        except ValueError as e:
+            db.session.rollback()
+            return {'error': str(e)}, 422
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
+    # Change part of the content without sending the whole note back and forth.
+    # {"base_version": 3, "ops": [{"offset": 120, "delete": 5, "insert": "text"}]}
+    def patch(self, note_id):
+        user_id = g.user_id
+
+        data = request.get_json(silent=True)
+        if not data:
+            return {'error': 'No data provided'}, 400
+        base_version = data.get('base_version')
+        if not isinstance(base_version, int):
+            return {'error': 'base_version is required'}, 400
+
+        note = Note.query.filter_by(id=note_id, user_id=user_id).first()
+        if not note:
+            return {'error': 'Note not found'}, 404
+        if note.version != base_version:
+            return {'error': 'Note was changed since base_version', 'version': note.version}, 409
+
+        try:
+            content = apply_edits(note.content, data.get('ops'))
+        except InvalidEdit as e:
+            return {'error': str(e)}, 422
+
+        try:
             if 'title' in data:
                 note.title = data['title']
-            if 'content' in data:
-                note.content = data['content']
-            if 'folder_id' in data:
-                folder = Folder.query.filter_by(id=data['folder_id'], user_id=user_id).first()
-                if not folder:
-                    return {'error': 'Folder not found'}, 404
-                note.folder_id = data['folder_id']
-
+            note.content = content
+            User.bump_data_version(user_id)
             db.session.commit()
-            return note.to_dict(), 200
-        
+            return note.to_dict(fields=('id', 'version', 'updated_at', 'preview', 'word_count')), 200
+
+        except StaleDataError:
+            # Another write got in between loading the note and saving it
+            db.session.rollback()
+            return {'error': 'Note was changed since base_version'}, 409
+        except ValueError as e:
+            db.session.rollback()
+            return {'error': str(e)}, 422
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
-    
+
     def delete(self, note_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         note = Note.query.filter_by(id=note_id, user_id=user_id).first()
         if not note:
@@ -227,28 +450,232 @@ class NotesDetail(Resource):
         
         try:
             db.session.delete(note)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_folders(user_id)
+            invalidate_user_tags(user_id)
             return {}, 204
         
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
-        
+
+class NoteContent(Resource):
+    method_decorators = [login_required]
+
+    # The raw note body, or part of it with a Range: bytes=... header or ?lines=first-last
+    def get(self, note_id):
+        user_id = g.user_id
+
+        note = Note.query.filter_by(id=note_id, user_id=user_id).first()
+        if not note:
+            return {'error': 'Note not found'}, 404
+
+        content = note.content or ''
+        lines = request.args.get('lines')
+        if lines:
+            try:
+                first, last = parse_line_range(lines)
+            except ValueError as e:
+                return {'error': str(e)}, 400
+            all_lines = content.splitlines(keepends=True)
+            response = Response(''.join(all_lines[first - 1:last]), mimetype='text/plain')
+            response.headers['X-Total-Lines'] = str(len(all_lines))
+        else:
+            body = content.encode('utf-8')
+            response = Response(body, mimetype='text/plain')
+            response.set_etag(note_etag(note))
+            # Answers Range requests with 206 and If-None-Match with 304
+            response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+        response.headers['X-Note-Version'] = str(note.version)
+        return response
+
+class NotesBatch(Resource):
+    method_decorators = [login_required]
+
+    OPERATIONS = ('create', 'update', 'move', 'delete')
+
+    # Many note changes in one request and one transaction
+    def post(self):
+        user_id = g.user_id
+
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('operations'), list):
+            return {'error': 'A list of operations is required'}, 400
+
+        operations = data['operations']
+        max_size = app.config['NOTES_BATCH_MAX_SIZE']
+        if not operations:
+            return {'error': 'A list of operations is required'}, 400
+        if len(operations) > max_size:
+            return {'error': f'A batch can have at most {max_size} operations'}, 413
+
+        try:
+            # Ownership of every folder and note in the batch is checked up front
+            owned_folders = {folder['id'] for folder in user_folders(user_id)}
+            note_ids = [
+                op['id'] for op in operations
+                if isinstance(op, dict) and op.get('op') != 'create' and isinstance(op.get('id'), int)
+            ]
+            owned_notes = {
+                note_id for note_id, _ in owned_by_id(db.session.query(Note.id, Note.user_id), Note, user_id, note_ids)
+            }
+
+            results = []
+            created = []
+            updates = {}
+            moves = {}
+            deletes = []
+            seen_ids = set()
+
+            for index, op in enumerate(operations):
+                result, error = self.check_operation(op, owned_folders, owned_notes, seen_ids)
+                if error:
+                    results.append({'index': index, 'op': op.get('op') if isinstance(op, dict) else None, **error})
+                    continue
+
+                kind = op['op']
+                try:
+                    if kind == 'create':
+                        created.append((index, Note.validated_row(
+                            title=op.get('title'),
+                            content=op.get('content', ''),
+                            folder_id=op['folder_id'],
+                            user_id=user_id
+                        )))
+                    elif kind == 'update':
+                        row = Note.validated_row(**{
+                            field: op[field] for field in ('title', 'content', 'folder_id') if field in op
+                        })
+                        # Updates that set the same columns share one executemany
+                        if row:
+                            updates.setdefault(tuple(sorted(row)), []).append(
+                                {'note_id': op['id'], **{f'new_{column}': value for column, value in row.items()}}
+                            )
+                    elif kind == 'move':
+                        moves.setdefault(op['folder_id'], []).append(op['id'])
+                    else:
+                        deletes.append(op['id'])
+                except ValueError as e:
+                    results.append({'index': index, 'op': kind, 'status': 422, 'error': str(e)})
+                    continue
+
+                results.append({'index': index, 'op': kind, **result})
+
+            # All or nothing, so nothing is written if any operation is invalid
+            if any(result['status'] >= 400 for result in results):
+                db.session.rollback()
+                return {'results': results}, 422
+
+            # One multi-row INSERT for the creates, like the importer
+            created_ids = []
+            if created:
+                inserted = db.session.execute(db.insert(Note).returning(Note.id), [row for _, row in created])
+                # Rowids are handed out in insert order, RETURNING order isn't guaranteed
+                created_ids = sorted(note_id for (note_id,) in inserted)
+
+            notes_table = Note.__table__
+            for columns, rows in updates.items():
+                db.session.execute(
+                    notes_table.update()
+                    .where(notes_table.c.id == db.bindparam('note_id'), notes_table.c.user_id == user_id)
+                    .values(
+                        version=notes_table.c.version + 1,
+                        **{column: db.bindparam(f'new_{column}') for column in columns}
+                    ),
+                    rows
+                )
+
+            for folder_id, ids in moves.items():
+                db.session.execute(
+                    db.update(Note)
+                    .where(Note.user_id == user_id, Note.id.in_(ids))
+                    .values(folder_id=folder_id, version=Note.version + 1),
+                    execution_options={'synchronize_session': False}
+                )
+
+            if deletes:
+                db.session.execute(
+                    db.delete(NoteTag).where(NoteTag.note_id.in_(deletes)),
+                    execution_options={'synchronize_session': False}
+                )
+                db.session.execute(
+                    db.delete(Note).where(Note.user_id == user_id, Note.id.in_(deletes)),
+                    execution_options={'synchronize_session': False}
+                )
+
+            User.bump_data_version(user_id)
+            db.session.flush()
+
+            # Index of each created or updated operation -> note id
+            changed = {index: note_id for (index, _), note_id in zip(created, created_ids)}
+            for result in results:
+                if result['op'] == 'update':
+                    changed[result['index']] = result['id']
+
+            db.session.commit()
+            # Creates, moves and deletes change the folder and tag note counts
+            if created or moves or deletes or any('folder_id' in op for op in operations if op['op'] == 'update'):
+                invalidate_user_folders(user_id)
+            if deletes:
+                invalidate_user_tags(user_id)
+
+            # Reload the changed notes in one query and return their new state
+            notes = Note.query.filter(Note.id.in_(list(changed.values()))).all() if changed else []
+            note_dicts = {note['id']: note for note in Note.to_dict_list(notes)}
+            for result in results:
+                if result['index'] in changed:
+                    result['id'] = changed[result['index']]
+                    result['note'] = note_dicts[result['id']]
+
+            return {'results': results}, 200
+
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
+    def check_operation(self, op, owned_folders, owned_notes, seen_ids):
+        """Validate one batch operation, returns (result, error)"""
+        if not isinstance(op, dict) or op.get('op') not in self.OPERATIONS:
+            return None, {'status': 400, 'error': f'op must be one of {", ".join(self.OPERATIONS)}'}
+
+        kind = op['op']
+        if kind != 'create':
+            note_id = op.get('id')
+            if not isinstance(note_id, int):
+                return None, {'status': 400, 'error': 'Note id is required'}
+            if note_id not in owned_notes:
+                return None, {'status': 404, 'id': note_id, 'error': 'Note not found'}
+            if note_id in seen_ids:
+                return None, {'status': 400, 'id': note_id, 'error': 'Note appears more than once in batch'}
+            seen_ids.add(note_id)
+
+        if kind in ('create', 'move') and not op.get('folder_id'):
+            return None, {'status': 400, 'error': 'Folder id is required'}
+        if 'folder_id' in op and (not isinstance(op['folder_id'], int) or op['folder_id'] not in owned_folders):
+            return None, {'status': 404, 'error': 'Folder not found'}
+
+        if kind == 'create':
+            return {'status': 201}, None
+        if kind == 'move':
+            return {'status': 200, 'id': op['id'], 'folder_id': op['folder_id']}, None
+        if kind == 'delete':
+            return {'status': 204, 'id': op['id']}, None
+        return {'status': 200, 'id': op['id']}, None
+
 class FoldersList(Resource):
+    method_decorators = [login_required]
+
+    @etag_by_data_version
     def get(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         # Get all folders and organize by created date
-        folders = Folder.query.filter_by(user_id=user_id).order_by(Folder.created_at).all()
-
-        return {'folders': [folder.to_dict() for folder in folders]}, 200
+        return {'folders': user_folders(user_id)}, 200
 
     def post(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         try:
             data = request.get_json()
@@ -268,7 +695,9 @@ class FoldersList(Resource):
             )
 
             db.session.add(new_folder)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_folders(user_id)
 
             return new_folder.to_dict(), 201
         
@@ -277,10 +706,10 @@ class FoldersList(Resource):
             return {'error': str(e)}, 500
         
 class FoldersDetail(Resource):
+    method_decorators = [login_required]
+
     def get(self, folder_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
         if not folder:
@@ -289,9 +718,7 @@ class FoldersDetail(Resource):
         return folder.to_dict(), 200
         
     def put(self, folder_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
     
         folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
         if not folder:
@@ -307,25 +734,65 @@ class FoldersDetail(Resource):
             if 'color' in data:
                 folder.color = data['color']
         
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_folders(user_id)
             return folder.to_dict(), 200
     
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
         
+    # ?notes=move_to:<folder id> moves the folder's notes first, ?notes=delete deletes them
     def delete(self, folder_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
         if not folder:
             return {'error': 'Folder not found'}, 404
+
+        policy = request.args.get('notes')
+        target_id = None
+        if policy and policy.startswith('move_to:'):
+            target_id = policy.partition(':')[2]
+            if not target_id.isdigit() or int(target_id) == folder_id:
+                return {'error': 'move_to needs the id of another folder'}, 400
+            target_id = int(target_id)
+            if not owns_folder(user_id, target_id):
+                return {'error': 'Folder to move notes to not found'}, 404
+        elif policy not in (None, 'delete'):
+            return {'error': "Notes must be 'move_to:<folder id>' or 'delete'"}, 400
+
+        folder_notes = db.select(Note.id).where(Note.user_id == user_id, Note.folder_id == folder_id)
+        if policy is None and db.session.query(folder_notes.exists()).scalar():
+            return {'error': 'Folder is not empty, pass notes=move_to:<folder id> or notes=delete'}, 409
         
         try:
-            db.session.delete(folder)
+            # A few set based statements, so no note is loaded however big the folder is
+            if target_id:
+                db.session.execute(
+                    db.update(Note)
+                    .where(Note.user_id == user_id, Note.folder_id == folder_id)
+                    .values(folder_id=target_id, version=Note.version + 1),
+                    execution_options={'synchronize_session': False}
+                )
+            else:
+                db.session.execute(
+                    db.delete(NoteTag).where(NoteTag.note_id.in_(folder_notes)),
+                    execution_options={'synchronize_session': False}
+                )
+                db.session.execute(
+                    db.delete(Note).where(Note.user_id == user_id, Note.folder_id == folder_id),
+                    execution_options={'synchronize_session': False}
+                )
+            db.session.execute(
+                db.delete(Folder).where(Folder.id == folder_id),
+                execution_options={'synchronize_session': False}
+            )
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_folders(user_id)
+            invalidate_user_tags(user_id)
             return {}, 204
         
         except Exception as e:
@@ -333,18 +800,16 @@ class FoldersDetail(Resource):
             return {'error': str(e)}, 500
         
 class TagsList(Resource):
+    method_decorators = [login_required]
+
+    @etag_by_data_version
     def get(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
-        tags = Tag.query.filter_by(user_id=user_id).all()
-        return {'tags': [tag.to_dict() for tag in tags]}, 200
+        return {'tags': user_tags(user_id)}, 200
     
     def post(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         try:
             data = request.get_json()
@@ -365,7 +830,9 @@ class TagsList(Resource):
             )
 
             db.session.add(new_tag)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_tags(user_id)
 
             return new_tag.to_dict(), 201
         
@@ -374,18 +841,20 @@ class TagsList(Resource):
             return {'error': str(e)}, 500
         
 class TagsDetail(Resource):
+    method_decorators = [login_required]
+
     def delete(self, tag_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 404
+        user_id = g.user_id
         
         tag = Tag.query.filter_by(id=tag_id, user_id=user_id).first()
         if not tag:
             return {'error': 'Tag not found.'}, 404
         
         try:
-            db.session.delete(tag)
+            Tag.delete_with_links(tag_id)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_tags(user_id)
             return {}, 204
         
         except Exception as e:
@@ -393,10 +862,10 @@ class TagsDetail(Resource):
             return {'error': str(e)}, 500
         
 class NoteTagsManagement(Resource):
+    method_decorators = [login_required]
+
     def post(self, note_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         note = Note.query.filter_by(id=note_id, user_id=user_id).first()
         if not note:
@@ -411,8 +880,7 @@ class NoteTagsManagement(Resource):
             if not tag_id:
                 return {'error': 'Tag ID is required'}, 400
             
-            tag = Tag.query.filter_by(id=tag_id, user_id=user_id).first()
-            if not tag:
+            if not owns_tag(user_id, tag_id):
                 return {'error': 'Tag not found'}, 404
             
             existing_tag = NoteTag.query.filter_by(note_id=note_id, tag_id=tag_id).first()
@@ -421,7 +889,9 @@ class NoteTagsManagement(Resource):
             
             note_tag = NoteTag(note_id=note_id, tag_id=tag_id)
             db.session.add(note_tag)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_tags(user_id)
 
             return {'message': 'Tag added to note'}, 201
         
@@ -430,9 +900,7 @@ class NoteTagsManagement(Resource):
             return {'error': str(e)}, 500
         
     def delete(self, note_id, tag_id):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         note = Note.query.filter_by(id=note_id, user_id=user_id).first()
         if not note:
@@ -444,7 +912,9 @@ class NoteTagsManagement(Resource):
                 return {'error': 'Tag not found on note'}, 404
             
             db.session.delete(note_tag)
+            User.bump_data_version(user_id)
             db.session.commit()
+            invalidate_user_tags(user_id)
 
             return {}, 204
         
@@ -452,17 +922,119 @@ class NoteTagsManagement(Resource):
             db.session.rollback()
             return {'error': str(e)}, 500
         
+class NoteTagsBulk(Resource):
+    method_decorators = [login_required]
+
+    # Attach or detach a set of tags to or from a set of notes
+    def post(self):
+        user_id = g.user_id
+
+        data = request.get_json(silent=True)
+        if not data:
+            return {'error': 'No data provided'}, 400
+
+        note_ids = data.get('note_ids')
+        tag_ids = data.get('tag_ids')
+        action = data.get('action', 'add')
+
+        if action not in ('add', 'remove'):
+            return {'error': "Action must be 'add' or 'remove'"}, 400
+
+        for ids, name in ((note_ids, 'Note'), (tag_ids, 'Tag')):
+            if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+                return {'error': f'{name} ids must be a non-empty list of ids'}, 400
+
+        note_ids = sorted(set(note_ids))
+        tag_ids = sorted(set(tag_ids))
+        max_size = app.config['NOTES_BATCH_MAX_SIZE']
+        if len(note_ids) > max_size:
+            return {'error': f'At most {max_size} notes can be tagged at once'}, 413
+
+        try:
+            owned_notes = {
+                note_id for note_id, _ in owned_by_id(db.session.query(Note.id, Note.user_id), Note, user_id, note_ids)
+            }
+            missing_notes = [note_id for note_id in note_ids if note_id not in owned_notes]
+            if missing_notes:
+                return {'error': 'Note not found', 'note_ids': missing_notes}, 404
+
+            owned_tags = {tag['id'] for tag in user_tags(user_id)}
+            missing_tags = [tag_id for tag_id in tag_ids if tag_id not in owned_tags]
+            if missing_tags:
+                return {'error': 'Tag not found', 'tag_ids': missing_tags}, 404
+
+            changed = 0
+            if action == 'add':
+                rows = [{'note_id': note_id, 'tag_id': tag_id} for note_id in note_ids for tag_id in tag_ids]
+                # Multi row inserts in chunks, links that already exist are skipped
+                for start in range(0, len(rows), 400):
+                    result = db.session.execute(
+                        sqlite_insert(NoteTag).values(rows[start:start + 400]).on_conflict_do_nothing()
+                    )
+                    changed += result.rowcount
+            else:
+                result = db.session.execute(
+                    db.delete(NoteTag).where(NoteTag.note_id.in_(note_ids), NoteTag.tag_id.in_(tag_ids)),
+                    execution_options={'synchronize_session': False}
+                )
+                changed = result.rowcount
+
+            if changed:
+                User.bump_data_version(user_id)
+            db.session.commit()
+            if changed:
+                invalidate_user_tags(user_id)
+
+            # Send back the new tag lists so the client doesn't need to refetch
+            tags_by_note = Note.tag_names_for(note_ids)
+            return {
+                'changed': changed,
+                'notes': [{'id': note_id, 'tags': tags_by_note.get(note_id, [])} for note_id in note_ids]
+            }, 200
+
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
 class NotesSearch(Resource):
+    method_decorators = [login_required]
+
     def get(self):
-        user_id = session.get('user_id')
-        if not user_id:
-            return {'error': 'Unauthorized'}, 401
+        user_id = g.user_id
         
         query_text = request.args.get('q', '').strip()
         folder_id = request.args.get('folder_id', type=int)
         tag_id = request.args.get('tag_id', type=int)
+        # 'fts' for ranked full text search, 'ilike' for plain substring matching
+        mode = request.args.get('mode', 'fts')
+        try:
+            fields = requested_note_fields()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        query = load_note_fields(Note.query.filter_by(user_id=user_id), fields)
+
+        if folder_id:
+            query = query.filter_by(folder_id=folder_id)
+
+        if tag_id:
+            query = query.join(NoteTag).filter(NoteTag.tag_id == tag_id)
+
+        if query_text and mode == 'fts':
+            results = fts_search(query, query_text)
+            if results is not None:
+                tags_by_note = {}
+                if not fields or 'tags' in fields:
+                    tags_by_note = Note.tag_names_for([row[0].id for row in results])
+                notes = []
+                for note, rank, title_highlight, snippet in results:
+                    note_dict = note.to_dict(tags=tags_by_note.get(note.id, []), fields=fields)
+                    note_dict['rank'] = rank
+                    note_dict['title_highlight'] = title_highlight
+                    note_dict['snippet'] = snippet
+                    notes.append(note_dict)
 
-        query = Note.query.filter_by(user_id=user_id)
+                return {'notes': notes, 'mode': 'fts'}, 200
 
         if query_text:
             search_filter = db.or_(
@@ -471,24 +1043,156 @@ class NotesSearch(Resource):
             )
             query = query.filter(search_filter)
 
-        if folder_id:
-            query = query.filter_by(folder_id=folder_id)
-
-        if tag_id:
-            query = query.join(NoteTag).filter(NoteTag.tag_id == tag_id)
-
         notes = query.order_by(Note.updated_at.desc()).all()
 
-        return {'notes': [note.to_dict() for note in notes]}, 200
+        return {'notes': Note.to_dict_list(notes, fields), 'mode': 'ilike'}, 200
     
+class Sync(Resource):
+    method_decorators = [login_required]
+
+    # Everything created, updated or deleted since the token. The first sync
+    # leaves out `since` and pages through the whole account.
+    def get(self):
+        user_id = g.user_id
+        since_token = request.args.get('since', '')
+        limit = request.args.get('limit', 500, type=int)
+
+        if limit < 1 or limit > 1000:
+            return {'error': 'Limit must be between 1 and 1000'}, 400
+
+        since = 0
+        if since_token:
+            try:
+                (since,) = decode_cursor(since_token, (int,))
+            except InvalidCursor:
+                return {'error': 'Invalid sync token'}, 400
+            # Change ids start at 1, a negative token would silently resend everything
+            if since < 0:
+                return {'error': 'Invalid sync token'}, 400
+
+        changes = (
+            Change.query
+            .filter(Change.user_id == user_id, Change.id > since)
+            .order_by(Change.id)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        changed = {'note': set(), 'folder': set(), 'tag': set(), 'note_tag': set()}
+        deleted = {'note': set(), 'folder': set(), 'tag': set(), 'note_tag': set()}
+        for change in changes:
+            if change.entity == 'note_tag':
+                key = tuple(int(part) for part in change.entity_key.split(':'))
+            else:
+                key = int(change.entity_key)
+            (deleted if change.deleted else changed)[change.entity].add(key)
+
+        notes = owned_by_id(Note.query, Note, user_id, changed['note'])
+        folders = owned_by_id(Folder.query, Folder, user_id, changed['folder'])
+        tags = owned_by_id(Tag.query, Tag, user_id, changed['tag'])
+
+        links = set()
+        if changed['note_tag']:
+            rows = db.session.query(NoteTag.note_id, NoteTag.tag_id).filter(
+                NoteTag.note_id.in_({note_id for note_id, _ in changed['note_tag']})
+            )
+            links = {tuple(row) for row in rows} & changed['note_tag']
+
+        # Anything that disappeared after its change was logged is gone as well
+        deleted['note'] |= changed['note'] - {note.id for note in notes}
+        deleted['folder'] |= changed['folder'] - {folder.id for folder in folders}
+        deleted['tag'] |= changed['tag'] - {tag.id for tag in tags}
+        deleted['note_tag'] |= changed['note_tag'] - links
+
+        return {
+            'notes': Note.to_dict_list(notes),
+            'folders': [folder.to_dict() for folder in folders],
+            'tags': [tag.to_dict() for tag in tags],
+            'note_tags': [{'note_id': note_id, 'tag_id': tag_id} for note_id, tag_id in sorted(links)],
+            'deleted': {
+                'notes': sorted(deleted['note']),
+                'folders': sorted(deleted['folder']),
+                'tags': sorted(deleted['tag']),
+                'note_tags': [{'note_id': note_id, 'tag_id': tag_id} for note_id, tag_id in sorted(deleted['note_tag'])]
+            },
+            'token': encode_cursor(changes[-1].id if changes else since),
+            'has_more': has_more
+        }, 200
+
+class Export(Resource):
+    method_decorators = [login_required]
+
+    # Download the whole account as NDJSON, streamed so memory stays flat
+    def get(self):
+        user_id = g.user_id
+        export_format = request.args.get('format', 'ndjson')
+
+        if export_format not in ('ndjson', 'ndjson.gz'):
+            return {'error': "Format must be 'ndjson' or 'ndjson.gz'"}, 400
+
+        chunks = ndjson_lines(export_notes(user_id))
+        mimetype = 'application/x-ndjson'
+        if export_format == 'ndjson.gz':
+            chunks = gzip_chunks(chunks)
+            mimetype = 'application/gzip'
+
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=notes.{export_format}'
+        return response
+
+class Import(Resource):
+    method_decorators = [login_required]
+
+    # Upload an NDJSON file (optionally gzipped) or a zip of Markdown files
+    def post(self):
+        user_id = g.user_id
+        upload = request.files.get('file')
+        if not upload:
+            return {'error': 'A file is required'}, 400
+
+        import_format = request.args.get('format')
+        if not import_format:
+            import_format = 'markdown' if upload.filename.lower().endswith('.zip') else 'ndjson'
+        if import_format not in ('ndjson', 'markdown'):
+            return {'error': "Format must be 'ndjson' or 'markdown'"}, 400
+
+        try:
+            if import_format == 'markdown':
+                records = iter_markdown_zip(upload.stream)
+            else:
+                records = iter_ndjson(upload.stream)
+            summary = import_notes(user_id, records)
+            return summary, 200
+
+        except ImportFailed as e:
+            # Earlier chunks are committed, tell the client what landed so a retry can skip it
+            return {'error': f'Could not read import file: {e}', 'line': e.line, 'imported': e.summary}, 400
+        except (ValueError, OSError, zipfile.BadZipFile) as e:
+            db.session.rollback()
+            return {'error': f'Could not read import file: {e}'}, 400
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            invalidate_user_folders(user_id)
+            invalidate_user_tags(user_id)
+
 api.add_resource(NotesList, '/api/notes')
 api.add_resource(NotesDetail, '/api/notes/<int:note_id>')
+api.add_resource(NoteContent, '/api/notes/<int:note_id>/content')
+api.add_resource(NotesBatch, '/api/notes/batch')
 api.add_resource(FoldersList, '/api/folders')
 api.add_resource(FoldersDetail, '/api/folders/<int:folder_id>')
 api.add_resource(TagsList, '/api/tags')
 api.add_resource(TagsDetail, '/api/tags/<int:tag_id>')
 api.add_resource(NoteTagsManagement, '/api/notes/<int:note_id>/tags', '/api/notes/<int:note_id>/tags/<int:tag_id>')
+api.add_resource(NoteTagsBulk, '/api/notes/tags')
 api.add_resource(NotesSearch, '/api/notes/search')
+api.add_resource(Sync, '/api/sync')
+api.add_resource(Export, '/api/export')
+api.add_resource(Import, '/api/import')
 
 # Server runs on port 5555
 if __name__ == '__main__':
@@ -0,0 +1,84 @@
+from functools import wraps
+from flask import g, session
+from sqlalchemy import event
+from config import db
+from models import User
+from caching import TTLCache
+
+# user id -> (username, session epoch), so most requests validate without SQL
+identity_cache = TTLCache()
+
+
+def init_auth(app):
+    identity_cache.configure(
+        max_size=app.config.get('IDENTITY_CACHE_SIZE', 4096),
+        ttl=app.config.get('IDENTITY_CACHE_TTL', 30)
+    )
+    app.before_request(load_current_user)
+
+
+def get_identity(user_id):
+    def load():
+        row = db.session.query(User.username, User.session_epoch).filter_by(id=user_id).first()
+        return tuple(row) if row else None
+
+    return identity_cache.get_or_load(user_id, load)
+
+
+def invalidate_identity(user_id):
+    identity_cache.invalidate(user_id)
+
+
+def log_in(user):
+    session['user_id'] = user.id
+    session['username'] = user.username
+    session['epoch'] = user.session_epoch or 0
+    identity_cache.set(user.id, (user.username, session['epoch']))
+
+
+def log_out():
+    for key in ('user_id', 'username', 'epoch'):
+        session.pop(key, None)
+
+
+def revoke_sessions(user_id):
+    """Invalidate every session of a user by moving their epoch forward"""
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id)
+        .values(session_epoch=User.session_epoch + 1)
+    )
+
+
+def load_current_user():
+    """Check the signed session against the cached identity before each request"""
+    g.user_id = None
+    g.username = None
+
+    user_id = session.get('user_id')
+    if not user_id:
+        return
+
+    identity = get_identity(user_id)
+    # Deleted user or a session from before the user's sessions were revoked
+    if identity is None or identity[1] != session.get('epoch', 0):
+        log_out()
+        return
+
+    g.user_id = user_id
+    g.username = identity[0]
+
+
+def login_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not g.get('user_id'):
+            return {'error': 'Unauthorized'}, 401
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@event.listens_for(User, 'after_delete')
+def forget_deleted_user(mapper, connection, target):
+    invalidate_identity(target.id)
@@ -0,0 +1,491 @@
+"""Endpoint benchmarks for the notes API.
+
+Builds (or reuses) a seeded SQLite database, then times the main endpoints
+in process through the Flask test client and over HTTP against a real
+multi-worker server. Results are written as JSON and can be compared with a
+stored baseline, exiting non-zero when an endpoint got slower.
+
+    python benchmark.py --users 200 --notes-per-user 500 --output results.json
+    python benchmark.py --reuse-db --baseline benchmarks/baseline.json
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(tempfile.gettempdir(), 'notes_benchmark.db')
+USERNAME = 'alice_wonder'
+PASSWORD = 'password123'
+# What the dashboard asks for when listing notes
+PREVIEW_FIELDS = 'title,preview,tags,updated_at'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'count': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if count else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if count else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'rps': round(count / elapsed, 1) if elapsed else None
+    }
+
+
+def prepare_database(args):
+    """Point the app at the benchmark database, migrating and seeding it if needed"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    sys.path.insert(0, SERVER_DIR)
+
+    if args.reuse_db and os.path.exists(args.db):
+        return
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    from flask_migrate import upgrade
+    from app import app
+    import seed
+
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+
+    seed.seed_database(seed.parse_args([
+        '--users', str(args.users),
+        '--notes-per-user', str(args.notes_per_user),
+        '--seed', str(args.seed),
+        '--processes', str(args.processes)
+    ]))
+
+
+def build_scenarios(args, fetch):
+    """The requests to time. `fetch(method, path, body)` returns (status, json) for setup calls"""
+    _, folders = fetch('GET', '/api/folders', None)
+    folder_id = folders['folders'][0]['id']
+    _, tags = fetch('GET', '/api/tags', None)
+    tag_id = tags['tags'][0]['id'] if tags['tags'] else 0
+
+    # Walk the cursor pages once to find a cursor near the end of the feed
+    deep_offset = max(0, args.notes_per_user - 20)
+    cursor = ''
+    for _ in range(deep_offset // 100):
+        _, page = fetch('GET', f'/api/notes?limit=100&cursor={cursor}', None)
+        if not page['pagination']['next_cursor']:
+            break
+        cursor = page['pagination']['next_cursor']
+
+    created = []
+
+    def create_body():
+        return {'title': 'Benchmark note', 'content': 'benchmark ' * 50, 'folder_id': folder_id}
+
+    def note_path():
+        return f'/api/notes/{created[-1]}' if created else '/api/notes/0'
+
+    return [
+        ('login', 'POST', lambda: '/login', lambda: {'username': USERNAME, 'password': PASSWORD}, args.login_requests),
+        ('check_session', 'GET', lambda: '/check_session', None, args.requests),
+        ('notes_shallow', 'GET', lambda: '/api/notes?limit=20', None, args.requests),
+        ('notes_deep_offset', 'GET', lambda: f'/api/notes?limit=20&offset={deep_offset}', None, args.requests),
+        ('notes_deep_cursor', 'GET', lambda: f'/api/notes?limit=20&cursor={cursor}', None, args.requests),
+        ('notes_page_100', 'GET', lambda: '/api/notes?limit=100', None, args.requests),
+        ('notes_page_100_preview', 'GET', lambda: f'/api/notes?limit=100&fields={PREVIEW_FIELDS}', None, args.requests),
+        ('notes_folder', 'GET', lambda: f'/api/notes?limit=20&folder_id={folder_id}', None, args.requests),
+        ('search_fts', 'GET', lambda: '/api/notes/search?q=grocery', None, args.requests),
+        ('search_ilike', 'GET', lambda: '/api/notes/search?q=grocery&mode=ilike', None, args.requests),
+        ('search_tag', 'GET', lambda: f'/api/notes/search?tag_id={tag_id}', None, args.requests),
+        ('folders', 'GET', lambda: '/api/folders', None, args.requests),
+        ('tags', 'GET', lambda: '/api/tags', None, args.requests),
+        ('note_create', 'POST', lambda: '/api/notes', create_body, args.write_requests),
+        ('note_update', 'PUT', note_path, lambda: {'content': f'updated {time.perf_counter()}'}, args.write_requests),
+        ('note_delete', 'DELETE', note_path, None, args.write_requests),
+    ], created
+
+
+def run_in_process(args):
+    """Time every scenario through the Flask test client, one request at a time"""
+    from app import app
+
+    client = app.test_client()
+    client.post('/login', json={'username': USERNAME, 'password': PASSWORD})
+
+    def fetch(method, path, body):
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json()
+
+    scenarios, created = build_scenarios(args, fetch)
+    results = {}
+    for name, method, path, body, count in scenarios:
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            if name == 'note_update' and not created:
+                break
+            request_body = body() if body else None
+            request_path = path()
+            before = time.perf_counter()
+            response = client.open(request_path, method=method, json=request_body)
+            latencies.append(time.perf_counter() - before)
+            if response.status_code >= 400:
+                errors += 1
+            elif name == 'note_create':
+                created.append(response.get_json()['id'])
+            elif name == 'note_delete' and created:
+                created.pop()
+        results[name] = summarize(latencies, time.perf_counter() - started, errors)
+        print(f"  in-process {name:20} p50 {results[name]['p50_ms']}ms p95 {results[name]['p95_ms']}ms")
+    return results
+
+
+def measure_payloads(args):
+    """Bytes on the wire and JSON encoding time for 100 note pages"""
+    from app import app
+    import responses
+
+    client = app.test_client()
+    client.post('/login', json={'username': USERNAME, 'password': PASSWORD})
+
+    results = {}
+    for name, path in (
+        ('notes_page_100', '/api/notes?limit=100'),
+        ('notes_page_100_preview', f'/api/notes?limit=100&fields={PREVIEW_FIELDS}'),
+        ('search_fts', '/api/notes/search?q=grocery'),
+    ):
+        body = client.get(path).get_json()
+        raw = responses.dumps(body)
+        sizes = {'identity_bytes': len(raw), 'gzip_bytes': len(gzip.compress(raw, compresslevel=6))}
+        if responses.brotli:
+            sizes['br_bytes'] = len(responses.brotli.compress(raw, quality=4))
+
+        timings = {}
+        for encoder, dumps in (('stdlib', lambda data: json.dumps(data).encode('utf-8')), ('fast', responses.dumps)):
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                dumps(body)
+            timings[f'{encoder}_encode_ms'] = round((time.perf_counter() - started) / args.requests * 1000, 3)
+
+        results[name] = {**sizes, **timings, 'encoder': 'orjson' if responses.orjson else 'json'}
+        print(f'  payload    {name:20} {results[name]}')
+    return results
+
+
+def run_bulk_deletes(args):
+    """Time deleting a tag linked to `bulk_notes` notes, then the user owning them.
+
+    Runs against a throwaway user so the seeded data is left as it was.
+    """
+    from app import app
+    from config import db
+    from models import User
+
+    with app.app_context():
+        user_id = db.session.execute(db.text(
+            "INSERT INTO users (username, email, _password_hash) "
+            "VALUES ('bulk_delete', 'bulk_delete@example.com', 'x') RETURNING id"
+        )).scalar()
+        folder_id = db.session.execute(db.text(
+            "INSERT INTO folders (name, color, user_id) VALUES ('Bulk', '#6b7280', :user_id) RETURNING id"
+        ), {'user_id': user_id}).scalar()
+        tag_id = db.session.execute(db.text(
+            "INSERT INTO tags (name, user_id) VALUES ('popular', :user_id) RETURNING id"
+        ), {'user_id': user_id}).scalar()
+        db.session.execute(db.text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count) "
+            "INSERT INTO notes (title, content, folder_id, user_id) "
+            "SELECT 'Bulk note ' || i, 'bulk delete benchmark', :folder_id, :user_id FROM n"
+        ), {'count': args.bulk_notes, 'folder_id': folder_id, 'user_id': user_id})
+        db.session.execute(db.text(
+            "INSERT INTO note_tags (note_id, tag_id) SELECT id, :tag_id FROM notes WHERE user_id = :user_id"
+        ), {'tag_id': tag_id, 'user_id': user_id})
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    results = {}
+    started = time.perf_counter()
+    response = client.delete(f'/api/tags/{tag_id}')
+    elapsed = time.perf_counter() - started
+    results['tag_delete'] = summarize([elapsed], elapsed, int(response.status_code >= 400))
+
+    with app.app_context():
+        started = time.perf_counter()
+        User.delete_with_data(user_id)
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+    results['user_delete'] = summarize([elapsed], elapsed, 0)
+
+    for name, result in results.items():
+        print(f"  bulk       {name:20} {result['p50_ms']}ms for {args.bulk_notes} notes")
+    return results
+
+
+class HttpClient:
+    """Keep-alive HTTP client that carries the session cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, body=None):
+        # Like a browser, so the timings include response compression
+        headers = {'Accept-Encoding': 'gzip'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the connection, reconnect once
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+
+        data = response.read()
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        return response.status, parsed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    env = dict(os.environ)
+    if shutil.which('gunicorn'):
+        command = ['gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    else:
+        # Fall back to werkzeug's forking server when gunicorn isn't installed
+        command = [sys.executable, os.path.abspath(__file__), '--serve', str(port), '--workers', str(args.workers)]
+
+    server = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('Benchmark server did not start')
+
+
+def run_http(args):
+    """Time every scenario over HTTP with `concurrency` client threads"""
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        setup = HttpClient(port)
+        setup.request('POST', '/login', {'username': USERNAME, 'password': PASSWORD})
+        scenarios, created = build_scenarios(args, setup.request)
+
+        clients = []
+        for _ in range(args.concurrency):
+            client = HttpClient(port)
+            client.request('POST', '/login', {'username': USERNAME, 'password': PASSWORD})
+            clients.append(client)
+
+        results = {}
+        for name, method, path, body, count in scenarios:
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            per_client = max(1, count // args.concurrency)
+            # Each client works on its own notes for the write scenarios
+            owned = [[] for _ in clients]
+
+            def work(index):
+                client = clients[index]
+                for _ in range(per_client):
+                    request_path = path()
+                    if name in ('note_update', 'note_delete'):
+                        if not owned[index]:
+                            break
+                        request_path = f'/api/notes/{owned[index][-1]}'
+                    request_body = body() if body else None
+                    before = time.perf_counter()
+                    status, data = client.request(method, request_path, request_body)
+                    elapsed = time.perf_counter() - before
+                    with lock:
+                        latencies.append(elapsed)
+                        if status >= 400:
+                            errors[0] += 1
+                    if name == 'note_create' and status < 400:
+                        created.append(data['id'])
+                    elif name == 'note_delete' and status < 400:
+                        owned[index].pop()
+
+            if name in ('note_update', 'note_delete'):
+                for index, note_id in enumerate(created):
+                    owned[index % len(clients)].append(note_id)
+
+            threads = [threading.Thread(target=work, args=(index,)) for index in range(len(clients))]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, time.perf_counter() - started, errors[0])
+            print(f"  http       {name:20} p50 {results[name]['p50_ms']}ms p95 {results[name]['p95_ms']}ms "
+                  f"{results[name]['rps']} req/s")
+            if name == 'note_delete':
+                created.clear()
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def failed_scenarios(results):
+    """List every scenario that had failed requests, a fast error is not a fast endpoint"""
+    return [
+        f"{mode}/{name}: {scenario['errors']} of {scenario['count']} requests failed"
+        for mode, scenarios in results.get('results', {}).items()
+        for name, scenario in scenarios.items()
+        if scenario.get('errors')
+    ]
+
+
+def compare(results, baseline, threshold):
+    """List every metric that got slower than the baseline by more than `threshold`, and more errors"""
+    regressions = []
+    for mode, scenarios in baseline.get('results', {}).items():
+        for name, old in scenarios.items():
+            new = results.get('results', {}).get(mode, {}).get(name)
+            if not new:
+                continue
+            if (new.get('errors') or 0) > (old.get('errors') or 0):
+                regressions.append(f"{mode}/{name} errors: {old.get('errors') or 0} -> {new['errors']}")
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if old.get(metric) and new.get(metric) and new[metric] > old[metric] * (1 + threshold):
+                    regressions.append(f'{mode}/{name} {metric}: {old[metric]}ms -> {new[metric]}ms')
+            if old.get('rps') and new.get('rps') and new['rps'] < old['rps'] / (1 + threshold):
+                regressions.append(f"{mode}/{name} rps: {old['rps']} -> {new['rps']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the notes API endpoints')
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite file to benchmark against')
+    parser.add_argument('--reuse-db', action='store_true', help='reuse --db if it exists instead of reseeding')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--notes-per-user', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--processes', type=int, default=1, help='processes for seeding')
+    parser.add_argument('--requests', type=int, default=200, help='requests per read scenario')
+    parser.add_argument('--write-requests', type=int, default=100, help='requests per write scenario')
+    parser.add_argument('--login-requests', type=int, default=20, help='requests for the login scenario')
+    parser.add_argument('--mode', choices=('in-process', 'http', 'both'), default='both')
+    parser.add_argument('--bulk-notes', type=int, default=100000,
+                        help='notes linked to the tag in the bulk delete benchmark, 0 to skip it')
+    parser.add_argument('--workers', type=int, default=4, help='server worker processes for http mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for http mode')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='baseline results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown against the baseline before failing (default 0.25 = 25%%)')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.serve:
+        sys.path.insert(0, SERVER_DIR)
+        from app import app
+        app.run(port=args.serve, processes=args.workers, threaded=False, use_reloader=False)
+        return 0
+
+    args.db = os.path.abspath(args.db)
+    prepare_database(args)
+
+    results = {
+        'meta': {
+            'users': args.users,
+            'notes_per_user': args.notes_per_user,
+            'bulk_notes': args.bulk_notes,
+            'db_size_bytes': os.path.getsize(args.db),
+            'seed': args.seed,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'python': sys.version.split()[0],
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': {}
+    }
+
+    if args.mode in ('in-process', 'both'):
+        print('In-process:')
+        results['results']['in_process'] = run_in_process(args)
+        print('Payloads:')
+        results['payloads'] = measure_payloads(args)
+    if args.bulk_notes:
+        print(f'Bulk deletes ({args.bulk_notes} notes):')
+        results['results']['bulk_delete'] = run_bulk_deletes(args)
+    if args.mode in ('http', 'both'):
+        print(f'HTTP ({args.workers} workers, {args.concurrency} clients):')
+        results['results']['http'] = run_http(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    failures = failed_scenarios(results)
+    if failures:
+        print('Scenarios with failed requests:')
+        for line in failures:
+            print(f'  {line}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions against the baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('No regressions against the baseline')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import hashlib
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from flask import g, request, make_response, has_request_context
+from config import db
+from models import User, Folder, Tag
+
+
+class TTLCache:
+    """Small thread safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Entries can carry a version: a lookup with a different version is a miss,
+    so writes from other worker processes show up as soon as they bump it.
+    """
+
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def configure(self, max_size, ttl):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get_or_load(self, key, loader, version=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # Load outside the lock so a slow query doesn't block other users
+        value = loader()
+        self.set(key, value, version)
+        return value
+
+    def set(self, key, value, version=None):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+
+# Per user folder and tag collections, sized from the app config at startup
+user_cache = TTLCache()
+
+
+def init_cache(app):
+    user_cache.configure(
+        max_size=app.config.get('USER_CACHE_SIZE', 1024),
+        ttl=app.config.get('USER_CACHE_TTL', 30)
+    )
+
+
+def data_version(user_id):
+    """The user's data version, read once per GET request by etag_by_data_version"""
+    if has_request_context() and request.method == 'GET' and g.get('data_version') is not None:
+        return g.data_version
+    return db.session.query(User.data_version).filter_by(id=user_id).scalar()
+
+
+def user_folders(user_id):
+    """All of a user's folders as dicts, oldest first"""
+    def load():
+        folders = Folder.query.filter_by(user_id=user_id).order_by(Folder.created_at).all()
+        return [folder.to_dict() for folder in folders]
+
+    return user_cache.get_or_load(('folders', user_id), load, data_version(user_id))
+
+
+def user_tags(user_id):
+    """All of a user's tags as dicts"""
+    def load():
+        return [tag.to_dict() for tag in Tag.query.filter_by(user_id=user_id).all()]
+
+    return user_cache.get_or_load(('tags', user_id), load, data_version(user_id))
+
+
+def owns_folder(user_id, folder_id):
+    try:
+        folder_id = int(folder_id)
+    except (TypeError, ValueError):
+        return False
+    return any(folder['id'] == folder_id for folder in user_folders(user_id))
+
+
+def owns_tag(user_id, tag_id):
+    try:
+        tag_id = int(tag_id)
+    except (TypeError, ValueError):
+        return False
+    return any(tag['id'] == tag_id for tag in user_tags(user_id))
+
+
+def invalidate_user_folders(user_id):
+    user_cache.invalidate(('folders', user_id))
+
+
+def invalidate_user_tags(user_id):
+    user_cache.invalidate(('tags', user_id))
+
+
+def etag_by_data_version(get):
+    """Answer GET requests with 304 while the user's data version is unchanged.
+
+    The ETag covers the user's data version plus the full request path, so
+    each page and filter of a list gets its own tag.
+    """
+    @wraps(get)
+    def wrapper(self, *args, **kwargs):
+        user_id = g.get('user_id')
+        version = None
+        if user_id:
+            version = db.session.query(User.data_version).filter_by(id=user_id).scalar()
+
+        # Not logged in or unknown user, the endpoint handles the error
+        if version is None:
+            return get(self, *args, **kwargs)
+        # Cached lists built for this request must match the ETag
+        g.data_version = version
+
+        key = f'{user_id}:{version}:{request.full_path}'
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        body, status = get(self, *args, **kwargs)[:2]
+        if status != 200:
+            return body, status
+
+        return body, status, {
+            'ETag': f'W/"{etag}"',
+            'Cache-Control': 'private, no-cache'
+        }
+
+    return wrapper
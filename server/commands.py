@@ -0,0 +1,205 @@
+import re
+import time
+import click
+from sqlalchemy import event
+from config import db
+from models import User, Folder, Tag
+from auth import invalidate_identity
+from caching import invalidate_user_folders, invalidate_user_tags
+from exporter import export_notes, ndjson_lines, gzip_chunks
+from importer import import_notes, iter_ndjson, iter_markdown_zip, ImportFailed
+
+# A SCAN of one of our tables without an index means a full table scan
+TABLE_SCAN = re.compile(r'^SCAN (users|folders|notes|tags|note_tags)\b(?!.*USING)')
+# Lookups of known ids must go by primary key, not walk an index on another column
+NOT_BY_PRIMARY_KEY = re.compile(r'^SEARCH (folders|notes|tags) USING (?!INTEGER PRIMARY KEY)')
+
+
+def captured_get(client, url):
+    """GET url with a test client, returns the response and the (statement, parameters) it ran"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    return response, statements
+
+
+def client_for(app, username):
+    """A test client logged in as username, or as the first user"""
+    user = User.query.filter_by(username=username).first() if username else User.query.first()
+    if not user:
+        raise click.ClickException('Need at least one user in the database, try running seed.py')
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.id
+    return user, client
+
+
+def register_commands(app):
+
+    @app.cli.command('export-notes')
+    @click.argument('username')
+    @click.option('--output', '-o', type=click.Path(dir_okay=False), help='File to write, defaults to stdout')
+    @click.option('--gzip', 'use_gzip', is_flag=True, help='Gzip the output')
+    def export_notes_command(username, output, use_gzip):
+        """Stream all of a user's notes out as NDJSON"""
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'No user named {username}')
+
+        chunks = ndjson_lines(export_notes(user.id))
+        if use_gzip:
+            chunks = gzip_chunks(chunks)
+
+        stream = click.open_file(output or '-', 'wb')
+        with stream:
+            for chunk in chunks:
+                stream.write(chunk)
+
+    @app.cli.command('import-notes')
+    @click.argument('username')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--chunk-size', default=5000, show_default=True, help='Notes per insert batch and transaction')
+    def import_notes_command(username, path, chunk_size):
+        """Import notes from an NDJSON file (optionally gzipped) or a zip of Markdown files"""
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'No user named {username}')
+        user_id = user.id
+
+        def progress(summary):
+            click.echo(f"  {summary['notes']} notes imported", err=True)
+
+        started = time.perf_counter()
+        with open(path, 'rb') as stream:
+            records = iter_markdown_zip(stream) if path.lower().endswith('.zip') else iter_ndjson(stream)
+            try:
+                summary = import_notes(user_id, records, chunk_size=chunk_size, progress=progress)
+            except ImportFailed as e:
+                raise click.ClickException(
+                    f"Could not read {path}: {e}. {e.summary['notes']} notes were imported before that"
+                )
+        elapsed = time.perf_counter() - started
+
+        rate = summary['notes'] / elapsed if elapsed else 0
+        click.echo(
+            f"Imported {summary['notes']} notes ({summary['folders_created']} new folders, "
+            f"{summary['tags_created']} new tags, {summary['skipped']} skipped) "
+            f"in {elapsed:.1f}s, {rate:.0f} notes/s"
+        )
+
+    @app.cli.command('delete-user')
+    @click.argument('username')
+    @click.confirmation_option(prompt='Delete this user and all of their notes?')
+    def delete_user(username):
+        """Delete a user with all of their folders, tags and notes"""
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'No user named {username}')
+
+        user_id = user.id
+        User.delete_with_data(user_id)
+        db.session.commit()
+        invalidate_identity(user_id)
+        invalidate_user_folders(user_id)
+        invalidate_user_tags(user_id)
+        click.echo(f'Deleted {username}')
+
+    @app.cli.command('repair-note-counts')
+    def repair_note_counts():
+        """Recompute every folder and tag note_count from the notes themselves"""
+        folders = Folder.recount_notes()
+        tags = Tag.recount_notes()
+        db.session.commit()
+        click.echo(f'Fixed {folders} folder count(s) and {tags} tag count(s)')
+
+    @app.cli.command('check-query-plans')
+    @click.option('--username', help='User to run the requests as (defaults to the first user)')
+    def check_query_plans(username):
+        """EXPLAIN every query the hot endpoints run and fail on table scans or id lookups off the primary key"""
+        user, client = client_for(app, username)
+        folder = Folder.query.filter_by(user_id=user.id).first()
+        tag = Tag.query.filter_by(user_id=user.id).first()
+        folder_id = folder.id if folder else 0
+        tag_id = tag.id if tag else 0
+
+        urls = [
+            '/check_session',
+            '/api/notes?limit=20',
+            f'/api/notes?limit=20&folder_id={folder_id}',
+            '/api/notes?limit=20&cursor=&include_total=true',
+            '/api/notes/search?q=note',
+            '/api/notes/search?q=note&mode=ilike',
+            f'/api/notes/search?tag_id={tag_id}',
+            '/api/folders',
+            '/api/tags',
+            '/api/sync?limit=200',
+        ]
+
+        failures = 0
+        for url in urls:
+            response, statements = captured_get(client, url)
+            click.echo(f'{url} -> {response.status_code}')
+            with db.engine.connect() as conn:
+                for statement, parameters in statements:
+                    if not statement.lstrip().upper().startswith('SELECT'):
+                        continue
+                    plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+                    scans = [row[-1] for row in plan if TABLE_SCAN.match(row[-1])]
+                    for detail in scans:
+                        failures += 1
+                        click.echo(f'  TABLE SCAN: {detail}')
+                        click.echo(f'    {" ".join(statement.split())}')
+                    for row in plan:
+                        match = NOT_BY_PRIMARY_KEY.match(row[-1])
+                        if match and f'{match.group(1)}.id IN (' in statement:
+                            failures += 1
+                            click.echo(f'  ID LOOKUP OFF THE PRIMARY KEY: {row[-1]}')
+                            click.echo(f'    {" ".join(statement.split())}')
+
+        if failures:
+            raise click.ClickException(f'{failures} bad query plan(s) found')
+        click.echo('No table scans or id lookups off the primary key found')
+
+    @app.cli.command('check-query-counts')
+    @click.option('--username', help='User to run the requests as (defaults to the first user)')
+    def check_query_counts(username):
+        """Fail if the note lists run more SQL statements for bigger pages"""
+        user, client = client_for(app, username)
+        folder = Folder.query.filter_by(user_id=user.id).first()
+        folder_id = folder.id if folder else 0
+
+        # Each endpoint at a small and a large result size
+        pairs = [
+            ('/api/notes?limit=5', '/api/notes?limit=100'),
+            ('/api/notes?limit=5&fields=title,preview,tags', '/api/notes?limit=100&fields=title,preview,tags'),
+            (f'/api/notes/search?q=note&folder_id={folder_id}', '/api/notes/search?q=note'),
+            (f'/api/notes/search?q=note&mode=ilike&folder_id={folder_id}', '/api/notes/search?q=note&mode=ilike'),
+        ]
+
+        failures = 0
+        for small_url, large_url in pairs:
+            counts = []
+            for url in (small_url, large_url):
+                # Once to warm the session and folder caches, then count
+                client.get(url)
+                response, statements = captured_get(client, url)
+                notes = len(response.get_json().get('notes', [])) if response.status_code == 200 else 0
+                counts.append(len(statements))
+                click.echo(f'{url} -> {response.status_code}, {notes} notes, {len(statements)} statements')
+
+            if counts[0] != counts[1]:
+                failures += 1
+                click.echo(f'  STATEMENT COUNT GROWS WITH PAGE SIZE: {counts[0]} -> {counts[1]}')
+
+        if failures:
+            raise click.ClickException(f'{failures} endpoint(s) run more statements for bigger pages')
+        click.echo('Statement counts do not depend on page size')
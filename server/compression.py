@@ -0,0 +1,76 @@
+import zlib
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import Text, TypeDecorator
+
+# Text shorter than this (in UTF-8 bytes) isn't worth compressing
+DEFAULT_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+
+class Compression:
+    """Settings shared by every CompressedText column, set from the app config"""
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=COMPRESS_LEVEL):
+        self.configure(min_size, level)
+
+    def configure(self, min_size=DEFAULT_MIN_SIZE, level=COMPRESS_LEVEL):
+        self.min_size = min_size
+        self.level = level
+
+
+compression = Compression()
+
+
+def compress_text(value):
+    """Text to store: unchanged when short, otherwise zlib compressed bytes.
+
+    SQLite keeps the bytes as a BLOB, which is how readers tell the two apart.
+    """
+    if value is None:
+        return None
+    data = value.encode('utf-8')
+    if not compression.min_size or len(data) < compression.min_size:
+        return value
+
+    compressed = zlib.compress(data, compression.level)
+    # Incompressible text stays as it is
+    return compressed if len(compressed) < len(data) else value
+
+
+def decompress_text(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+class CompressedText(TypeDecorator):
+    """Text column that stores long values compressed.
+
+    Reads always give back the original string. Comparisons such as ilike
+    run against the decompressed text through the note_text SQL function.
+    """
+    impl = Text
+    cache_ok = True
+
+    class comparator_factory(Text.Comparator):
+        def operate(self, op, *other, **kwargs):
+            return op(func.note_text(self.expr, type_=Text), *other, **kwargs)
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+
+@event.listens_for(Engine, 'connect')
+def register_sql_functions(dbapi_connection, connection_record):
+    # Used by the search triggers, the notes_fts_source view and ilike search
+    create_function = getattr(dbapi_connection, 'create_function', None)
+    if create_function:
+        create_function('note_text', 1, decompress_text, deterministic=True)
+
+
+def init_compression(app):
+    compression.configure(min_size=app.config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE))
@@ -0,0 +1,40 @@
+class InvalidEdit(ValueError):
+    pass
+
+
+def apply_edits(text, operations):
+    """Apply [{'offset', 'delete', 'insert'}] edits to text, one after another.
+
+    Offsets count characters in the text as it is after the previous edits.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise InvalidEdit('A list of edit operations is required')
+
+    text = text or ''
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            raise InvalidEdit(f'Operation {index} must be an object')
+        offset = op.get('offset')
+        delete = op.get('delete', 0)
+        insert = op.get('insert', '')
+        if not isinstance(offset, int) or not isinstance(delete, int) or not isinstance(insert, str):
+            raise InvalidEdit(f'Operation {index} needs an integer offset and delete and a string insert')
+        if offset < 0 or delete < 0 or offset + delete > len(text):
+            raise InvalidEdit(f'Operation {index} is outside the note ({len(text)} characters)')
+
+        text = text[:offset] + insert + text[offset + delete:]
+
+    return text
+
+
+def parse_line_range(value):
+    """'10-20', '10-' or '10' into 1-based (first, last) lines, last may be None"""
+    first, dash, last = value.partition('-')
+    try:
+        first = int(first)
+        last = int(last) if last else (None if dash else first)
+    except ValueError:
+        raise ValueError('Lines must look like 10-20')
+    if first < 1 or (last is not None and last < first):
+        raise ValueError('Lines must look like 10-20')
+    return first, last
@@ -0,0 +1,52 @@
+import json
+import zlib
+from config import db
+from models import Note, Folder
+
+EXPORT_BATCH_SIZE = 500
+
+
+def export_notes(user_id, batch_size=EXPORT_BATCH_SIZE):
+    """Yield every note of a user as a dict, with its folder name and tags.
+
+    Rows are streamed from the database in batches of `batch_size` and tags
+    are loaded once per batch, so memory stays flat however many notes there are.
+    """
+    stmt = (
+        db.select(Note, Folder.name)
+        .join(Folder, Folder.id == Note.folder_id)
+        .where(Note.user_id == user_id)
+        .order_by(Note.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    for rows in db.session.execute(stmt).partitions():
+        tags_by_note = Note.tag_names_for([note.id for note, _ in rows])
+        for note, folder_name in rows:
+            yield {
+                'id': note.id,
+                'title': note.title,
+                'content': note.content,
+                'folder': folder_name,
+                'tags': tags_by_note.get(note.id, []),
+                'created_at': note.created_at.isoformat() if note.created_at else None,
+                'updated_at': note.updated_at.isoformat() if note.updated_at else None
+            }
+
+        # Let the finished batch be garbage collected
+        db.session.expunge_all()
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of byte chunks without holding the whole output"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
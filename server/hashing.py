@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from flask import current_app
+from config import bcrypt
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already running or queued"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool.
+
+    bcrypt releases the GIL, so the pool caps how many cores login and signup
+    can take at once. When the pool and its queue are full new requests fail
+    right away with HashingBusy instead of piling up behind each other.
+    """
+
+    def __init__(self, workers=None, queue_depth=16):
+        self.configure(workers, queue_depth)
+
+    def configure(self, workers=None, queue_depth=16):
+        workers = workers or os.cpu_count() or 2
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = BoundedSemaphore(workers + queue_depth)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('Too many login attempts in progress, try again shortly')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(bcrypt.generate_password_hash, password).decode('utf-8')
+
+    def check(self, password_hash, password):
+        return self._run(bcrypt.check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher()
+
+
+def init_hashing(app):
+    password_hasher.configure(
+        workers=app.config.get('HASH_WORKERS'),
+        queue_depth=app.config.get('HASH_QUEUE_DEPTH', 16)
+    )
+
+
+def hash_cost(password_hash):
+    """Read the cost out of a bcrypt hash like $2b$12$..."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash):
+    # The same setting Bcrypt.init_app hashes with, 12 is its default too
+    return hash_cost(password_hash) != current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
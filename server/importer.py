@@ -0,0 +1,216 @@
+import gzip
+import json
+import posixpath
+import zipfile
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from config import db
+from models import User, Folder, Note, Tag, NoteTag
+
+IMPORT_CHUNK_SIZE = 5000
+DEFAULT_FOLDER = 'Imported'
+DEFAULT_COLOR = '#6b7280'
+
+
+class InvalidLine(ValueError):
+    """A line of an NDJSON upload that isn't valid JSON"""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+class ImportFailed(Exception):
+    """The upload stopped being readable part way through.
+
+    Chunks before the bad record are already committed, `summary` counts
+    them and `line` is the bad NDJSON line when there is one.
+    """
+
+    def __init__(self, error, summary):
+        super().__init__(str(error))
+        self.summary = summary
+        self.line = getattr(error, 'line', None)
+
+
+def iter_ndjson(stream):
+    """Yield one record per line of an NDJSON (or gzipped NDJSON) binary stream"""
+    if hasattr(stream, 'peek'):
+        magic = stream.peek(2)[:2]
+    else:
+        # Uploaded files are spooled, so they can be rewound
+        magic = stream.read(2)
+        stream.seek(0)
+
+    if magic == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise InvalidLine(number, e)
+
+
+def iter_markdown_zip(fileobj):
+    """Yield one record per .md file in a zip, folders come from the directory name"""
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(('.md', '.markdown')):
+                continue
+
+            text = archive.read(info).decode('utf-8', errors='replace')
+            directory, filename = posixpath.split(info.filename)
+            title, content, tags = parse_markdown(text, posixpath.splitext(filename)[0])
+            yield {
+                'title': title,
+                'content': content,
+                'folder': posixpath.basename(directory) or DEFAULT_FOLDER,
+                'tags': tags
+            }
+
+
+def parse_markdown(text, fallback_title):
+    """Pull tags out of simple front matter and use a leading # heading as the title"""
+    tags = []
+    if text.startswith('---\n'):
+        end = text.find('\n---', 4)
+        if end != -1:
+            for line in text[4:end].splitlines():
+                key, _, value = line.partition(':')
+                if key.strip() == 'tags':
+                    tags = [tag.strip(' "\'') for tag in value.strip(' []').split(',') if tag.strip(' "\'')]
+            text = text[end + 4:].lstrip('\n')
+
+    title = fallback_title
+    first_line, _, rest = text.partition('\n')
+    if first_line.startswith('# '):
+        title = first_line[2:]
+        text = rest.lstrip('\n')
+
+    return title, text, tags
+
+
+def clean_record(record):
+    """Apply the model rules to a raw record, returns None for unusable records"""
+    if not isinstance(record, dict):
+        return None
+
+    title = str(record.get('title') or '').strip()[:100].strip() or 'Untitled'
+    folder = str(record.get('folder') or '').strip()[:25].strip() or DEFAULT_FOLDER
+    content = record.get('content')
+    tags = record.get('tags') or []
+    if not isinstance(tags, list):
+        tags = []
+
+    return {
+        'title': title,
+        'content': content if isinstance(content, str) else '',
+        'folder': folder,
+        'tags': list(dict.fromkeys(str(tag).strip()[:50].strip() for tag in tags if str(tag).strip()))
+    }
+
+
+def _ensure_folders(user_id, names, folder_ids):
+    missing = [name for name in names if name not in folder_ids]
+    if missing:
+        db.session.execute(
+            db.insert(Folder),
+            [{'name': name, 'color': DEFAULT_COLOR, 'user_id': user_id} for name in missing]
+        )
+        folder_ids.update(
+            db.session.query(Folder.name, Folder.id)
+            .filter(Folder.user_id == user_id, Folder.name.in_(missing))
+        )
+    return len(missing)
+
+
+def _ensure_tags(user_id, names, tag_ids):
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        db.session.execute(
+            sqlite_insert(Tag).on_conflict_do_nothing(),
+            [{'name': name, 'user_id': user_id} for name in missing]
+        )
+        tag_ids.update(
+            db.session.query(Tag.name, Tag.id)
+            .filter(Tag.user_id == user_id, Tag.name.in_(missing))
+        )
+    return len(missing)
+
+
+def _import_chunk(user_id, chunk, folder_ids, tag_ids, summary):
+    folders_created = _ensure_folders(user_id, {r['folder'] for r in chunk}, folder_ids)
+    tags_created = _ensure_tags(user_id, {t for r in chunk for t in r['tags']}, tag_ids)
+
+    result = db.session.execute(
+        db.insert(Note).returning(Note.id),
+        [
+            {
+                'title': r['title'],
+                'content': r['content'],
+                'folder_id': folder_ids[r['folder']],
+                'user_id': user_id,
+                **Note.summarize(r['content'])
+            }
+            for r in chunk
+        ]
+    )
+    # Rowids are handed out in increasing order as rows are inserted, so the
+    # sorted ids line up with the chunk even if RETURNING comes back unordered
+    note_ids = sorted(note_id for (note_id,) in result)
+
+    links = [
+        {'note_id': note_id, 'tag_id': tag_ids[tag]}
+        for note_id, record in zip(note_ids, chunk)
+        for tag in record['tags']
+    ]
+    if links:
+        db.session.execute(db.insert(NoteTag), links)
+
+    User.bump_data_version(user_id)
+    db.session.commit()
+    # Only counted once committed, so a failed import reports just what was saved
+    summary['notes'] += len(chunk)
+    summary['folders_created'] += folders_created
+    summary['tags_created'] += tags_created
+
+
+def import_notes(user_id, records, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Insert a stream of note records for a user.
+
+    Missing folders and tags are created by name. Notes go in with multi-row
+    inserts and each chunk is committed on its own, so a big import never
+    holds one huge transaction. `progress` is called with the running summary
+    after every chunk. A record that can't be read raises ImportFailed with
+    the summary of the chunks committed before it.
+    """
+    folder_ids = dict(db.session.query(Folder.name, Folder.id).filter(Folder.user_id == user_id))
+    tag_ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.user_id == user_id))
+    summary = {'notes': 0, 'folders_created': 0, 'tags_created': 0, 'skipped': 0}
+
+    chunk = []
+    try:
+        for record in records:
+            record = clean_record(record)
+            if record is None:
+                summary['skipped'] += 1
+                continue
+
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                _import_chunk(user_id, chunk, folder_ids, tag_ids, summary)
+                chunk = []
+                if progress:
+                    progress(summary)
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        db.session.rollback()
+        raise ImportFailed(e, summary) from e
+
+    if chunk:
+        _import_chunk(user_id, chunk, folder_ids, tag_ids, summary)
+        if progress:
+            progress(summary)
+
+    return summary
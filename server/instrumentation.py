@@ -0,0 +1,231 @@
+import os
+import re
+import sys
+import time
+from threading import Lock
+from flask import g, request, has_request_context, current_app, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Literals and expanded IN lists, stripped so repeats of one query share a shape
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_PARAM_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryPatternError(Exception):
+    """A request repeated one query too often or ran a slow one, in QUERY_WATCH=raise mode"""
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """Per endpoint request metrics, kept in memory for this process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = {}
+        self.latency = {}
+        self.sql_count = {}
+        self.sql_time = {}
+        self.response_size = {}
+        # TTLCache instances whose counters are read when /metrics is scraped
+        self.caches = {}
+
+    def add_cache(self, name, cache):
+        self.caches[name] = cache
+
+    def record(self, endpoint, method, status, duration, sql_count, sql_time, size):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.sql_count.setdefault(endpoint, Histogram(QUERY_COUNT_BUCKETS)).observe(sql_count)
+            self.sql_time.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(sql_time)
+            if size is not None:
+                self.response_size.setdefault(endpoint, Histogram(SIZE_BUCKETS)).observe(size)
+
+    def render(self):
+        """Everything in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP notes_requests_total Requests handled, by endpoint, method and status.',
+                '# TYPE notes_requests_total counter'
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'notes_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            for name, help_text, histograms in (
+                ('notes_request_duration_seconds', 'Time spent handling a request.', self.latency),
+                ('notes_sql_queries_per_request', 'SQL statements run by a request.', self.sql_count),
+                ('notes_sql_duration_seconds', 'Time a request spent running SQL.', self.sql_time),
+                ('notes_response_size_bytes', 'Size of response bodies.', self.response_size),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(histograms.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.total}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+        if self.caches:
+            stats = {name: cache.stats() for name, cache in sorted(self.caches.items())}
+            for stat, kind, help_text in (
+                ('hits', 'counter', 'Cache lookups answered from memory.'),
+                ('misses', 'counter', 'Cache lookups that went to the database.'),
+                ('size', 'gauge', 'Entries currently cached.'),
+            ):
+                name = f'notes_cache_{stat}' + ('_total' if kind == 'counter' else '')
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for cache_name, values in stats.items():
+                    lines.append(f'{name}{{cache="{cache_name}"}} {values[stat]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_started' in g:
+        g.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_started' in g:
+        elapsed = time.perf_counter() - g.pop('query_started')
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if 'query_shapes' in g:
+            watch_query(statement, elapsed, executemany)
+
+
+def query_shape(statement):
+    statement = SQL_LITERALS.sub('?', statement)
+    statement = SQL_PARAM_LISTS.sub('(?...)', statement)
+    return ' '.join(statement.split())
+
+
+def query_origin():
+    """The chain of our own functions that led to a query, innermost first"""
+    frames = []
+    frame = sys._getframe(1)
+    while frame:
+        filename = frame.f_code.co_filename
+        if os.path.dirname(filename) == SERVER_DIR and not filename.endswith('instrumentation.py'):
+            frames.append(f'{os.path.basename(filename)}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' <- '.join(frames) or 'unknown'
+
+
+def watch_query(statement, elapsed, executemany):
+    """Group a request's queries by shape and remember where each shape came from.
+
+    Batches from executemany are deliberate bulk writes, so only their latency is checked.
+    """
+    shape = query_shape(statement)
+    if not executemany:
+        seen = g.query_shapes.get(shape)
+        if seen:
+            seen[0] += 1
+        else:
+            g.query_shapes[shape] = [1, query_origin()]
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        g.slow_queries.append((elapsed, shape, query_origin()))
+
+
+def query_problems():
+    repeat_limit = current_app.config['QUERY_REPEAT_LIMIT']
+    problems = [
+        f'{count} runs of the same query from {origin}: {shape}'
+        for shape, (count, origin) in g.query_shapes.items() if count > repeat_limit
+    ]
+    problems += [
+        f'slow query ({elapsed * 1000:.0f} ms) from {origin}: {shape}'
+        for elapsed, shape, origin in g.slow_queries
+    ]
+    return problems
+
+
+def report_queries(response):
+    """Log or raise for N+1 patterns and slow queries seen during the request"""
+    if 'query_shapes' not in g:
+        return response
+
+    problems = query_problems()
+    if not problems:
+        return response
+    summary = f'{request.method} {request.path}: ' + '; '.join(problems)
+    if current_app.config['QUERY_WATCH'] == 'raise':
+        raise QueryPatternError(summary)
+    current_app.logger.warning(summary)
+    return response
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    if current_app.config.get('QUERY_WATCH', 'off') != 'off':
+        g.query_shapes = {}
+        g.slow_queries = []
+
+
+def finish_request(response):
+    if 'request_started' not in g:
+        return response
+
+    duration = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    metrics.record(endpoint, request.method, response.status_code, duration, g.sql_count, g.sql_time, size)
+
+    if g.get('server_timing'):
+        response.headers['Server-Timing'] = (
+            f'app;dur={duration * 1000:.2f}, '
+            f'db;dur={g.sql_time * 1000:.2f};desc="{g.sql_count} queries"'
+        )
+    return response
+
+
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    """Register the hooks first, so timing starts before any other before_request
+    hook and the after_request hook runs last, on the final response"""
+    def enable_server_timing():
+        g.server_timing = app.config.get('SERVER_TIMING', False)
+
+    app.config.setdefault('QUERY_WATCH', 'off')
+    app.config.setdefault('QUERY_REPEAT_LIMIT', 10)
+    app.config.setdefault('SLOW_QUERY_MS', 100)
+
+    app.before_request(start_request)
+    app.before_request(enable_server_timing)
+    app.after_request(finish_request)
+    app.after_request(report_queries)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
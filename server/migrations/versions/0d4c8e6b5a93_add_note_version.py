@@ -0,0 +1,26 @@
+"""add note version
+
+Revision ID: 0d4c8e6b5a93
+Revises: f2b7d6a0c418
+Create Date: 2026-10-17 21:36:52.804417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d4c8e6b5a93'
+down_revision = 'f2b7d6a0c418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    # Plain DROP COLUMN, a batch rebuild of notes would lose its triggers
+    op.execute('ALTER TABLE notes DROP COLUMN version')
@@ -0,0 +1,86 @@
+"""add change log
+
+Revision ID: 3b6f0e8d9a21
+Revises: a7d2c94e1b08
+Create Date: 2026-10-17 14:05:51.207339
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b6f0e8d9a21'
+down_revision = 'a7d2c94e1b08'
+branch_labels = None
+depends_on = None
+
+# Tables that own a user_id and are logged by their own id
+OWNED_TABLES = {
+    'folders': 'folder',
+    'tags': 'tag',
+    'notes': 'note',
+}
+
+
+def upgrade():
+    op.create_table('changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('entity_key', sa.String(length=40), nullable=False),
+    sa.Column('deleted', sa.Boolean(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('entity', 'entity_key', name='unique_change_per_entity'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_changes_user_id', 'changes', ['user_id', 'id'], unique=False)
+
+    # One row per entity, INSERT OR REPLACE moves it to the end of the log
+    for table, entity in OWNED_TABLES.items():
+        for event, row, deleted in (('INSERT', 'new', 0), ('UPDATE', 'new', 0), ('DELETE', 'old', 1)):
+            op.execute(f"""
+                CREATE TRIGGER {table}_changes_{event.lower()} AFTER {event} ON {table}
+                WHEN {row}.user_id IS NOT NULL BEGIN
+                    INSERT OR REPLACE INTO changes (user_id, entity, entity_key, deleted)
+                    VALUES ({row}.user_id, '{entity}', {row}.id, {deleted});
+                END
+            """)
+
+    for event, row, deleted in (('INSERT', 'new', 0), ('DELETE', 'old', 1)):
+        op.execute(f"""
+            CREATE TRIGGER note_tags_changes_{event.lower()} AFTER {event} ON note_tags
+            WHEN (SELECT user_id FROM notes WHERE id = {row}.note_id) IS NOT NULL BEGIN
+                INSERT OR REPLACE INTO changes (user_id, entity, entity_key, deleted)
+                VALUES (
+                    (SELECT user_id FROM notes WHERE id = {row}.note_id),
+                    'note_tag',
+                    {row}.note_id || ':' || {row}.tag_id,
+                    {deleted}
+                );
+            END
+        """)
+
+    # Existing rows count as changes so a sync from scratch sees everything
+    for table, entity in OWNED_TABLES.items():
+        op.execute(f"""
+            INSERT INTO changes (user_id, entity, entity_key, deleted)
+            SELECT user_id, '{entity}', id, 0 FROM {table} WHERE user_id IS NOT NULL
+        """)
+    op.execute("""
+        INSERT INTO changes (user_id, entity, entity_key, deleted)
+        SELECT notes.user_id, 'note_tag', note_tags.note_id || ':' || note_tags.tag_id, 0
+        FROM note_tags JOIN notes ON notes.id = note_tags.note_id
+        WHERE notes.user_id IS NOT NULL
+    """)
+
+
+def downgrade():
+    for table in OWNED_TABLES:
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f'DROP TRIGGER IF EXISTS {table}_changes_{event}')
+    for event in ('insert', 'delete'):
+        op.execute(f'DROP TRIGGER IF EXISTS note_tags_changes_{event}')
+
+    op.drop_index('ix_changes_user_id', table_name='changes')
+    op.drop_table('changes')
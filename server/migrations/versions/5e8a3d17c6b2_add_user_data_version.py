@@ -0,0 +1,26 @@
+"""add user data version
+
+Revision ID: 5e8a3d17c6b2
+Revises: d41f8b9e2c57
+Create Date: 2026-10-17 11:47:02.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a3d17c6b2'
+down_revision = 'd41f8b9e2c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
@@ -0,0 +1,62 @@
+"""add notes full text index
+
+Revision ID: 9c2e7a41f0b3
+Revises: 578994f18c60
+Create Date: 2026-10-17 10:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e7a41f0b3'
+down_revision = '578994f18c60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # External content FTS5 table, the text itself stays in notes
+    op.execute("""
+        CREATE VIRTUAL TABLE notes_fts USING fts5(
+            title,
+            content,
+            content='notes',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+
+    # Triggers keep the index in sync for every write path (ORM or raw SQL)
+    op.execute("""
+        CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, title, content)
+            VALUES (new.id, new.title, new.content);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO notes_fts(rowid, title, content)
+            VALUES (new.id, new.title, new.content);
+        END
+    """)
+
+    # Backfill the index from the existing notes
+    op.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS notes_fts_au')
+    op.execute('DROP TRIGGER IF EXISTS notes_fts_ad')
+    op.execute('DROP TRIGGER IF EXISTS notes_fts_ai')
+    op.execute('DROP TABLE IF EXISTS notes_fts')
@@ -0,0 +1,26 @@
+"""add user session epoch
+
+Revision ID: a7d2c94e1b08
+Revises: 5e8a3d17c6b2
+Create Date: 2026-10-17 13:21:37.662410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2c94e1b08'
+down_revision = '5e8a3d17c6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('session_epoch', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('session_epoch')
@@ -0,0 +1,71 @@
+"""add note counts
+
+Revision ID: c81f4e2a7d39
+Revises: 3b6f0e8d9a21
+Create Date: 2026-10-17 16:22:40.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f4e2a7d39'
+down_revision = '3b6f0e8d9a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('folders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('note_count', sa.Integer(), server_default='0', nullable=False))
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('note_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Counters move with the rows in the same transaction as the write
+    op.execute("""
+        CREATE TRIGGER notes_note_count_insert AFTER INSERT ON notes BEGIN
+            UPDATE folders SET note_count = note_count + 1 WHERE id = new.folder_id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER notes_note_count_update AFTER UPDATE OF folder_id ON notes
+        WHEN old.folder_id IS NOT new.folder_id BEGIN
+            UPDATE folders SET note_count = note_count - 1 WHERE id = old.folder_id;
+            UPDATE folders SET note_count = note_count + 1 WHERE id = new.folder_id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER notes_note_count_delete AFTER DELETE ON notes BEGIN
+            UPDATE folders SET note_count = note_count - 1 WHERE id = old.folder_id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER note_tags_note_count_insert AFTER INSERT ON note_tags BEGIN
+            UPDATE tags SET note_count = note_count + 1 WHERE id = new.tag_id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER note_tags_note_count_delete AFTER DELETE ON note_tags BEGIN
+            UPDATE tags SET note_count = note_count - 1 WHERE id = old.tag_id;
+        END
+    """)
+
+    op.execute("""
+        UPDATE folders SET note_count = (
+            SELECT COUNT(*) FROM notes WHERE notes.user_id = folders.user_id AND notes.folder_id = folders.id
+        )
+    """)
+    op.execute("""
+        UPDATE tags SET note_count = (SELECT COUNT(*) FROM note_tags WHERE note_tags.tag_id = tags.id)
+    """)
+
+
+def downgrade():
+    for table in ('notes', 'note_tags'):
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f'DROP TRIGGER IF EXISTS {table}_note_count_{event}')
+
+    # Plain DROP COLUMN, a batch rebuild of the tables would lose their change log triggers
+    op.execute('ALTER TABLE tags DROP COLUMN note_count')
+    op.execute('ALTER TABLE folders DROP COLUMN note_count')
@@ -0,0 +1,34 @@
+"""add hot path indexes
+
+Revision ID: d41f8b9e2c57
+Revises: 9c2e7a41f0b3
+Create Date: 2026-10-17 11:03:19.550871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f8b9e2c57'
+down_revision = '9c2e7a41f0b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Note feed: filter by user (and folder), newest first, id breaks ties
+    op.create_index('ix_notes_user_updated', 'notes', ['user_id', 'updated_at', 'id'], unique=False)
+    op.create_index('ix_notes_user_folder_updated', 'notes', ['user_id', 'folder_id', 'updated_at', 'id'], unique=False)
+    # Tag filtering starts from the tag side of the junction table
+    op.create_index('ix_note_tags_tag_note', 'note_tags', ['tag_id', 'note_id'], unique=False)
+    op.create_index('ix_folders_user_created', 'folders', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_tags_user_name', 'tags', ['user_id', 'name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tags_user_name', table_name='tags')
+    op.drop_index('ix_folders_user_created', table_name='folders')
+    op.drop_index('ix_note_tags_tag_note', table_name='note_tags')
+    op.drop_index('ix_notes_user_folder_updated', table_name='notes')
+    op.drop_index('ix_notes_user_updated', table_name='notes')
@@ -0,0 +1,107 @@
+"""compress note content
+
+Revision ID: e5a9c3f1b7d4
+Revises: c81f4e2a7d39
+Create Date: 2026-10-17 18:41:09.663175
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from compression import compress_text, decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c3f1b7d4'
+down_revision = 'c81f4e2a7d39'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def create_fts(content_table, content_expression):
+    op.execute(f"""
+        CREATE VIRTUAL TABLE notes_fts USING fts5(
+            title,
+            content,
+            content='{content_table}',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    new_content = content_expression.format(row='new')
+    old_content = content_expression.format(row='old')
+    op.execute(f"""
+        CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, title, content)
+            VALUES (new.id, new.title, {new_content});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, {old_content});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, {old_content});
+            INSERT INTO notes_fts(rowid, title, content)
+            VALUES (new.id, new.title, {new_content});
+        END
+    """)
+    op.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def drop_fts():
+    for trigger in ('notes_fts_au', 'notes_fts_ad', 'notes_fts_ai'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS notes_fts')
+
+
+def rewrite_content(convert, where):
+    """Rewrite note content batch by batch, without logging it as a change"""
+    connection = op.get_bind()
+    # Same text either way, so clients don't need to sync these rows again
+    trigger_sql = connection.execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'notes_changes_update'"
+    )).scalar()
+    if trigger_sql:
+        op.execute('DROP TRIGGER notes_changes_update')
+
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.text(
+            f"SELECT id, content FROM notes WHERE id > :last_id AND {where} ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        updates = []
+        for note_id, content in rows:
+            converted = convert(content)
+            if converted is not content:
+                updates.append({'id': note_id, 'content': converted})
+        if updates:
+            connection.execute(sa.text('UPDATE notes SET content = :content WHERE id = :id'), updates)
+        last_id = rows[-1][0]
+
+    if trigger_sql:
+        op.execute(trigger_sql)
+
+
+def upgrade():
+    # The search index reads note text through a view that decompresses it
+    drop_fts()
+    op.execute("CREATE VIEW notes_fts_source AS SELECT id, title, note_text(content) AS content FROM notes")
+
+    rewrite_content(compress_text, "typeof(content) = 'text'")
+    create_fts('notes_fts_source', 'note_text({row}.content)')
+
+
+def downgrade():
+    drop_fts()
+    rewrite_content(decompress_text, "typeof(content) = 'blob'")
+    op.execute('DROP VIEW IF EXISTS notes_fts_source')
+    create_fts('notes', '{row}.content')
@@ -0,0 +1,65 @@
+"""add note preview and word count
+
+Revision ID: f2b7d6a0c418
+Revises: e5a9c3f1b7d4
+Create Date: 2026-10-17 20:03:27.145872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from compression import decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7d6a0c418'
+down_revision = 'e5a9c3f1b7d4'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+PREVIEW_LENGTH = 100
+
+
+def summarize(content):
+    # Note.summarize as of this revision, kept here so later model changes don't alter it
+    text = ' '.join((content or '').split())
+    preview = text
+    if len(text) > PREVIEW_LENGTH:
+        preview = text[:PREVIEW_LENGTH].rstrip() + '...'
+    return {'preview': preview, 'word_count': len(text.split())}
+
+
+def upgrade():
+    with op.batch_alter_table('notes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('preview', sa.String(length=120), server_default='', nullable=False))
+        batch_op.add_column(sa.Column('word_count', sa.Integer(), server_default='0', nullable=False))
+
+    connection = op.get_bind()
+    # Derived columns only, clients don't need to sync every note again
+    trigger_sql = connection.execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'notes_changes_update'"
+    )).scalar()
+    if trigger_sql:
+        op.execute('DROP TRIGGER notes_changes_update')
+
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.text(
+            'SELECT id, content FROM notes WHERE id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        connection.execute(
+            sa.text('UPDATE notes SET preview = :preview, word_count = :word_count WHERE id = :id'),
+            [{'id': note_id, **summarize(decompress_text(content))} for note_id, content in rows]
+        )
+        last_id = rows[-1][0]
+
+    if trigger_sql:
+        op.execute(trigger_sql)
+
+
+def downgrade():
+    # Plain DROP COLUMN, a batch rebuild of notes would lose its triggers
+    op.execute('ALTER TABLE notes DROP COLUMN word_count')
+    op.execute('ALTER TABLE notes DROP COLUMN preview')
@@ -1,8 +1,19 @@
+import json
 import re
-from sqlalchemy import DateTime, UniqueConstraint, func
+from sqlalchemy import DateTime, Index, UniqueConstraint, func
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, validates
-from config import db, bcrypt
+from config import db
+from hashing import password_hasher, needs_rehash
+from compression import CompressedText
+
+
+# Everything Note.to_dict can return, in order. List endpoints take a subset with ?fields=
+NOTE_FIELDS = (
+    'id', 'title', 'content', 'folder_id', 'user_id', 'tags',
+    'created_at', 'updated_at', 'preview', 'word_count', 'version'
+)
+PREVIEW_LENGTH = 100
 
 
 class User(db.Model):
@@ -12,6 +23,10 @@ class User(db.Model):
     username = db.Column(db.String(30), unique=True, nullable=False)
     email = db.Column(db.String, unique=True, nullable=False)
     _password_hash = db.Column(db.String(100), nullable=False)
+    # Bumped by every write to the user's notes, folders or tags
+    data_version = db.Column(db.Integer, server_default='0', nullable=False)
+    # Sessions carry this epoch, bumping it logs the user out everywhere
+    session_epoch = db.Column(db.Integer, server_default='0', nullable=False)
 
     # Relationships
     folders = relationship('Folder', back_populates='user', cascade='all, delete-orphan')
@@ -55,11 +70,40 @@ class User(db.Model):
     def password_hash(self, password):
         if len(password) < 8:
             raise ValueError('Password must be at least 8 characters long')
-        self._password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self._password_hash = password_hasher.hash(password)
 
     def authenticate(self, password):
-        return bcrypt.check_password_hash(self._password_hash, password)
+        return password_hasher.check(self._password_hash, password)
+
+    def password_needs_rehash(self):
+        # True when the hash was made with a different bcrypt cost than configured
+        return needs_rehash(self._password_hash)
     
+    @staticmethod
+    def bump_data_version(user_id):
+        """Mark the user's data as changed, commits with the caller's transaction"""
+        db.session.execute(
+            db.update(User)
+            .where(User.id == user_id)
+            .values(data_version=User.data_version + 1)
+        )
+
+    @staticmethod
+    def delete_with_data(user_id):
+        """Delete a user and everything they own with a few set based statements.
+
+        The ORM cascade would load every note, folder, tag and link first.
+        """
+        options = {'synchronize_session': False}
+        user_notes = db.select(Note.id).where(Note.user_id == user_id)
+        db.session.execute(db.delete(NoteTag).where(NoteTag.note_id.in_(user_notes)), execution_options=options)
+        db.session.execute(db.delete(Note).where(Note.user_id == user_id), execution_options=options)
+        db.session.execute(db.delete(Tag).where(Tag.user_id == user_id), execution_options=options)
+        db.session.execute(db.delete(Folder).where(Folder.user_id == user_id), execution_options=options)
+        # Last, the deletes above log their own changes
+        db.session.execute(db.delete(Change).where(Change.user_id == user_id), execution_options=options)
+        db.session.execute(db.delete(User).where(User.id == user_id), execution_options=options)
+
     def to_dict(self):
         user_dict = {
             'id': self.id,
@@ -78,6 +122,12 @@ class Folder(db.Model):
     color = db.Column(db.String(7), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+    # Kept up to date by database triggers on notes
+    note_count = db.Column(db.Integer, server_default='0', nullable=False)
+
+    __table_args__ = (
+        Index('ix_folders_user_created', 'user_id', 'created_at'),
+    )
 
     #Relationships
     user = relationship('User', back_populates='folders')
@@ -109,9 +159,25 @@ class Folder(db.Model):
             'name': self.name,
             'color': self.color,
             'user_id': self.user_id,
+            'note_count': self.note_count,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+    @staticmethod
+    def recount_notes():
+        """Fix every folder's note_count in one statement, returns the number fixed"""
+        # Notes always share their folder's user, which lets the count use the notes index
+        actual = (
+            db.select(func.count())
+            .where(Note.user_id == Folder.user_id, Note.folder_id == Folder.id)
+            .scalar_subquery()
+        )
+        result = db.session.execute(
+            db.update(Folder).where(Folder.note_count != actual).values(note_count=actual),
+            execution_options={'synchronize_session': False}
+        )
+        return result.rowcount
+
     def __repr__(self):
         return f'<Folder: {self.name}>'
 
@@ -120,11 +186,24 @@ class Note(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
-    content = db.Column(db.Text)
+    # Long notes are stored zlib compressed, see compression.py
+    content = db.Column(CompressedText)
+    # Derived from content whenever it is set, so note lists can skip loading it
+    preview = db.Column(db.String(120), server_default='', nullable=False)
+    word_count = db.Column(db.Integer, server_default='0', nullable=False)
     folder_id = db.Column(db.Integer, db.ForeignKey('folders.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+    # Goes up with every ORM update, which only applies if the version is still the one loaded
+    version = db.Column(db.Integer, server_default='1', nullable=False)
+
+    # Indexes for the note feed, newest first within a user or folder
+    __table_args__ = (
+        Index('ix_notes_user_updated', 'user_id', 'updated_at', 'id'),
+        Index('ix_notes_user_folder_updated', 'user_id', 'folder_id', 'updated_at', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     # Relationships
     user = relationship('User', back_populates='notes')
@@ -145,17 +224,79 @@ class Note(db.Model):
         
         return value
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'content': self.content,
-            'folder_id': self.folder_id,
-            'user_id': self.user_id,
-            'tags': [tag.name for tag in self.tags],
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    @validates('content')
+    def validate_content(self, key, value):
+        if value is not None and not isinstance(value, str):
+            raise ValueError('Content must be a string')
+        summary = Note.summarize(value)
+        self.preview = summary['preview']
+        self.word_count = summary['word_count']
+        return value
+
+    @classmethod
+    def validated_row(cls, **fields):
+        """Run the model validators over fields, returns the column values for a bulk write"""
+        note = cls(**fields)
+        row = {key: getattr(note, key) for key in fields}
+        if 'content' in fields:
+            row['preview'] = note.preview
+            row['word_count'] = note.word_count
+        return row
+
+    @staticmethod
+    def summarize(content):
+        """The preview and word_count columns for a note body"""
+        text = ' '.join((content or '').split())
+        preview = text
+        if len(text) > PREVIEW_LENGTH:
+            preview = text[:PREVIEW_LENGTH].rstrip() + '...'
+        return {'preview': preview, 'word_count': len(text.split())}
+
+    def to_dict(self, tags=None, fields=None):
+        # Pass tags in when they were already loaded to skip the lazy load
+        fields = fields or NOTE_FIELDS
+        if 'tags' in fields and tags is None:
+            tags = [tag.name for tag in self.tags]
+
+        note_dict = {}
+        for field in fields:
+            if field == 'tags':
+                note_dict['tags'] = tags
+            elif field in ('created_at', 'updated_at'):
+                value = getattr(self, field)
+                note_dict[field] = value.isoformat() if value else None
+            else:
+                note_dict[field] = getattr(self, field)
+        return note_dict
+
+    @classmethod
+    def to_dict_list(cls, notes, fields=None):
+        """Serialize a list of notes, loading the tags for all of them at once"""
+        fields = fields or NOTE_FIELDS
+        tags_by_note = cls.tag_names_for([note.id for note in notes]) if 'tags' in fields else {}
+        return [note.to_dict(tags=tags_by_note.get(note.id, []), fields=fields) for note in notes]
+
+    @staticmethod
+    def tag_names_for(note_ids):
+        """Map note id -> list of tag names with a single query"""
+        tags_by_note = {}
+        if not note_ids:
+            return tags_by_note
+
+        # The ids go in as one JSON array parameter, so any number of notes is
+        # one statement and SQLite's bound parameter limit never comes into it
+        ids = func.json_each(json.dumps(note_ids)).table_valued('value')
+        rows = (
+            db.session.query(NoteTag.note_id, Tag.name)
+            .join(Tag, Tag.id == NoteTag.tag_id)
+            .filter(NoteTag.note_id.in_(db.select(ids.c.value)))
+            .order_by(Tag.name)
+            .all()
+        )
+        for note_id, name in rows:
+            tags_by_note.setdefault(note_id, []).append(name)
+
+        return tags_by_note
 
     def __repr__(self):
         return f'<Note: {self.title}>'
@@ -166,10 +307,13 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Kept up to date by database triggers on note_tags
+    note_count = db.Column(db.Integer, server_default='0', nullable=False)
 
     # Junction table for many to many relationship
     __table_args__ = (
         UniqueConstraint('name', 'user_id', name='unique_tag_per_user'),
+        Index('ix_tags_user_name', 'user_id', 'name'),
     )
 
     # Relationships
@@ -193,9 +337,32 @@ class Tag(db.Model):
         return {
             'id': self.id,
             'name': self.name,
-            'user_id': self.user_id
+            'user_id': self.user_id,
+            'note_count': self.note_count
         }
 
+    @staticmethod
+    def recount_notes():
+        """Fix every tag's note_count in one statement, returns the number fixed"""
+        actual = db.select(func.count()).where(NoteTag.tag_id == Tag.id).scalar_subquery()
+        result = db.session.execute(
+            db.update(Tag).where(Tag.note_count != actual).values(note_count=actual),
+            execution_options={'synchronize_session': False}
+        )
+        return result.rowcount
+
+    @staticmethod
+    def delete_with_links(tag_id):
+        """Delete a tag and its note links without loading the links into the session"""
+        db.session.execute(
+            db.delete(NoteTag).where(NoteTag.tag_id == tag_id),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(
+            db.delete(Tag).where(Tag.id == tag_id),
+            execution_options={'synchronize_session': False}
+        )
+
     def __repr__(self):
         return f'<Tag: {self.name}>'
 
@@ -205,7 +372,28 @@ class NoteTag(db.Model):
     note_id = db.Column(db.Integer, db.ForeignKey('notes.id'), primary_key=True)
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
 
+    __table_args__ = (
+        Index('ix_note_tags_tag_note', 'tag_id', 'note_id'),
+    )
+
     note = relationship("Note", back_populates="note_tags", overlaps="notes, tags")
     tag = relationship("Tag", back_populates="note_tags", overlaps="notes, tags")
 
-    
\ No newline at end of file
+class Change(db.Model):
+    __tablename__ = 'changes'
+
+    # Filled in by database triggers on folders, tags, notes and note_tags
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(10), nullable=False)
+    entity_key = db.Column(db.String(40), nullable=False)
+    deleted = db.Column(db.Boolean, server_default='0', nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('entity', 'entity_key', name='unique_change_per_entity'),
+        Index('ix_changes_user_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f'<Change: {self.entity} {self.entity_key}>'
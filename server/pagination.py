@@ -0,0 +1,30 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row on a page into an opaque string"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """Unpack a cursor made by encode_cursor, checking it holds one value of each type in `types`"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise InvalidCursor('Invalid cursor')
+    for value, expected in zip(values, types):
+        # bool is an int subclass, but true is never a valid id
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise InvalidCursor('Invalid cursor')
+
+    return values
@@ -0,0 +1,76 @@
+import html
+import re
+from sqlalchemy.exc import OperationalError
+from config import db
+from models import Note
+
+# Title matches count for more than content matches when ranking
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+SNIPPET_TOKENS = 12
+# Private use characters mark the matches, so the note text can be HTML
+# escaped before they are turned into <mark> tags
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+FTS_QUERY = db.text(
+    "SELECT rowid AS note_id, "
+    "bm25(notes_fts, :title_weight, :content_weight) AS rank, "
+    "highlight(notes_fts, 0, :match_start, :match_end) AS title_highlight, "
+    "snippet(notes_fts, 1, :match_start, :match_end, '...', :snippet_tokens) AS snippet "
+    "FROM notes_fts WHERE notes_fts MATCH :match"
+).columns(
+    db.column('note_id', db.Integer),
+    db.column('rank', db.Float),
+    db.column('title_highlight', db.String),
+    db.column('snippet', db.String)
+)
+
+
+def build_match_query(text):
+    """Turn raw search box text into a safe FTS5 prefix query"""
+    # Only word characters make it through, so users can't inject FTS syntax
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def mark_matches(text):
+    """HTML escape highlight() or snippet() output and wrap the matches in <mark>"""
+    if text is None:
+        return None
+    return html.escape(text).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def fts_search(query, query_text):
+    """Run a ranked full text search on top of an existing Note query.
+
+    Returns a list of (note, rank, title_highlight, snippet) tuples ordered by
+    BM25 rank, or None when full text search can't be used for this query.
+    The highlight and snippet are escaped HTML with the matches in <mark>.
+    """
+    match = build_match_query(query_text)
+    if not match:
+        return None
+
+    fts = FTS_QUERY.bindparams(
+        match=match,
+        title_weight=TITLE_WEIGHT,
+        content_weight=CONTENT_WEIGHT,
+        snippet_tokens=SNIPPET_TOKENS,
+        match_start=MATCH_START,
+        match_end=MATCH_END
+    ).subquery('fts')
+
+    try:
+        rows = (
+            query.join(fts, fts.c.note_id == Note.id)
+            .add_columns(fts.c.rank, fts.c.title_highlight, fts.c.snippet)
+            .order_by(fts.c.rank, Note.updated_at.desc())
+            .all()
+        )
+    except OperationalError:
+        # Index missing (e.g. migrations not run yet), caller falls back to ilike
+        db.session.rollback()
+        return None
+
+    return [(note, rank, mark_matches(title), mark_matches(snippet)) for note, rank, title, snippet in rows]
@@ -1,161 +1,284 @@
 from app import app
 from config import db
-from models import User, Folder, Note, Tag, NoteTag
-from faker import Faker
+from models import User, Folder, Note, Tag, NoteTag, Change
+from hashing import password_hasher
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import argparse
+import math
 import random
+import time
+
+PASSWORD = 'password123'
+NAMED_USERS = ['alice_wonder', 'bob_builder', 'charlie_brown', 'diana_prince', 'evan_smith']
+FOLDER_NAMES = [
+    'Work', 'Personal', 'Projects', 'Ideas', 'Meeting Notes',
+    'Research', 'To-Do', 'Study', 'Travel', 'Goals'
+]
+COLORS = ['#ef4444', '#f59e0b', '#10b981', '#3b82f6', '#8b5cf6', '#ec4899', '#6b7280', '#14b8a6', '#f97316', '#84cc16']
+TAG_NAMES = [
+    'important', 'urgent', 'review', 'draft', 'completed',
+    'idea', 'meeting', 'todo', 'reference', 'archive',
+    'project', 'personal', 'work', 'study', 'planning'
+]
+# Word list for the fast content generator, Faker is much slower
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+    'ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla '
+    'pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim '
+    'id est laborum meeting project budget plan review draft idea report schedule team client design '
+    'release deadline research notes travel goals study recipe grocery list apple banana coffee'
+).split()
+START_DATE = datetime(2025, 1, 1)
+
+
+def parse_range(value):
+    """Parse '5' or '5-10' into a (low, high) tuple"""
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
 
-fake = Faker()
 
 def clear_database():
     """Clear all existing data from the database"""
     print("Clearing database...")
-    with app.app_context():
-        NoteTag.query.delete()
-        Note.query.delete()
-        Tag.query.delete()
-        Folder.query.delete()
-        User.query.delete()
-        db.session.commit()
+    NoteTag.query.delete()
+    Note.query.delete()
+    Tag.query.delete()
+    Folder.query.delete()
+    User.query.delete()
+    Change.query.delete()
     print("Database cleared!")
 
-def create_users():
-    """Create 5 test users"""
-    print("Creating users...")
-    users = []
-    usernames = ['alice_wonder', 'bob_builder', 'charlie_brown', 'diana_prince', 'evan_smith']
-    
-    for username in usernames:
-        user = User(
-            username=username,
-            email=f"{username}@example.com"
-        )
-        user.password_hash = "password123"
-        users.append(user)
-        db.session.add(user)
-    
-    db.session.commit()
-    print(f"Created {len(users)} users!")
-    return users
-
-def create_folders(users):
-    """Create 2-3 folders per user"""
-    print("Creating folders...")
-    folders = []
-    folder_names = [
-        'Work', 'Personal', 'Projects', 'Ideas', 'Meeting Notes',
-        'Research', 'To-Do', 'Study', 'Travel', 'Goals'
-    ]
-    colors = ['#EF4444', '#F59E0B', '#10B981', '#3B82F6', '#8B5CF6', '#EC4899', '#6B7280', '#14B8A6', '#F97316', '#84CC16']
-    
-    for user in users:
-        num_folders = random.randint(2, 3)
-        user_folder_names = random.sample(folder_names, num_folders)
-        
-        for folder_name in user_folder_names:
-            folder = Folder(
-                name=folder_name,
-                color=random.choice(colors),
-                user_id=user.id
-            )
-            folders.append(folder)
-            db.session.add(folder)
-    
-    db.session.commit()
-    print(f"Created {len(folders)} folders!")
-    return folders
-
-def create_tags(users):
-    """Create 3-5 tags per user"""
-    print("Creating tags...")
-    tags = []
-    tag_names = [
-        'important', 'urgent', 'review', 'draft', 'completed',
-        'idea', 'meeting', 'todo', 'reference', 'archive',
-        'project', 'personal', 'work', 'study', 'planning'
-    ]
-    
-    for user in users:
-        num_tags = random.randint(3, 5)
-        user_tag_names = random.sample(tag_names, num_tags)
-        
-        for tag_name in user_tag_names:
-            tag = Tag(
-                name=tag_name,
-                user_id=user.id
-            )
-            tags.append(tag)
-            db.session.add(tag)
-    
-    db.session.commit()
-    print(f"Created {len(tags)} tags!")
-    return tags
-
-def create_notes(users, folders, tags):
-    """Create 5-10 notes per user"""
-    print("Creating notes...")
+
+def suspend_triggers():
+    """Drop the database triggers for the bulk load, returns their SQL to put them back"""
+    triggers = db.session.execute(db.text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all()
+    for name, _ in triggers:
+        db.session.execute(db.text(f'DROP TRIGGER "{name}"'))
+    return [sql for _, sql in triggers]
+
+
+def restore_triggers(statements):
+    for sql in statements:
+        db.session.execute(db.text(sql))
+
+
+def rebuild_derived_data():
+    """Write in a few set-based statements what the triggers would have written row by row"""
+    print("Rebuilding search index, change log and note counts...")
+    db.session.execute(db.text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+    for table, entity in (('folders', 'folder'), ('tags', 'tag'), ('notes', 'note')):
+        db.session.execute(db.text(
+            f"INSERT INTO changes (user_id, entity, entity_key, deleted) "
+            f"SELECT user_id, '{entity}', id, 0 FROM {table} WHERE user_id IS NOT NULL"
+        ))
+    db.session.execute(db.text(
+        "INSERT INTO changes (user_id, entity, entity_key, deleted) "
+        "SELECT notes.user_id, 'note_tag', note_tags.note_id || ':' || note_tags.tag_id, 0 "
+        "FROM note_tags JOIN notes ON notes.id = note_tags.note_id WHERE notes.user_id IS NOT NULL"
+    ))
+    Folder.recount_notes()
+    Tag.recount_notes()
+
+
+def make_content(rng, median_words, sigma, fake=None):
+    """Note body whose length in words follows a log-normal distribution"""
+    num_words = max(5, int(rng.lognormvariate(math.log(median_words), sigma)))
+    if fake:
+        return fake.text(max_nb_chars=num_words * 6)
+
+    words = rng.choices(WORDS, k=num_words)
+    paragraphs = []
+    for start in range(0, num_words, 60):
+        paragraph = ' '.join(words[start:start + 60])
+        paragraphs.append(paragraph[0].upper() + paragraph[1:] + '.')
+    return '\n\n'.join(paragraphs)
+
+
+def generate_user(task):
+    """Build every folder, tag, note and link for one user.
+
+    Each user gets their own random generator seeded from the global seed, so
+    the output is the same no matter how many processes share the work.
+    """
+    user_index, options = task
+    rng = random.Random(f"{options['seed']}:{user_index}")
+    fake = None
+    if options['faker']:
+        from faker import Faker
+        fake = Faker()
+        fake.seed_instance(f"{options['seed']}:{user_index}")
+
+    folders = rng.sample(FOLDER_NAMES, rng.randint(*options['folders']))
+    folder_colors = [rng.choice(COLORS) for _ in folders]
+    tags = rng.sample(TAG_NAMES, min(len(TAG_NAMES), rng.randint(*options['tags'])))
+
     notes = []
-    
-    for user in users:
-        # Get user's folders and tags
-        user_folders = [f for f in folders if f.user_id == user.id]
-        user_tags = [t for t in tags if t.user_id == user.id]
-        
-        num_notes = random.randint(5, 10)
-        
-        for i in range(num_notes):
-            # Generate lorem ipsum content
-            num_paragraphs = random.randint(2, 5)
-            content = '\n\n'.join([fake.paragraph(nb_sentences=random.randint(3, 8)) for _ in range(num_paragraphs)])
-            
-            note = Note(
-                title=fake.sentence(nb_words=random.randint(3, 8)).rstrip('.'),
-                content=content,
-                folder_id=random.choice(user_folders).id,
-                user_id=user.id
-            )
-            db.session.add(note)
-            db.session.flush()  # Flush to get the note ID
-            
-            # Add 0-3 random tags to each note
-            num_note_tags = random.randint(0, min(3, len(user_tags)))
-            if num_note_tags > 0:
-                note_tags_to_add = random.sample(user_tags, num_note_tags)
-                for tag in note_tags_to_add:
-                    note_tag = NoteTag(note_id=note.id, tag_id=tag.id)
-                    db.session.add(note_tag)
-            
-            notes.append(note)
-    
-    db.session.commit()
-    print(f"Created {len(notes)} notes!")
-    return notes
-
-def seed_database():
+    for _ in range(rng.randint(*options['notes'])):
+        if fake:
+            title = fake.sentence(nb_words=rng.randint(3, 8)).rstrip('.')
+        else:
+            title = ' '.join(rng.choices(WORDS, k=rng.randint(3, 8))).capitalize()
+        updated_at = START_DATE + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        notes.append((
+            title[:100],
+            make_content(rng, options['content_words'], options['content_sigma'], fake),
+            rng.randrange(len(folders)),
+            rng.sample(range(len(tags)), rng.randint(0, min(3, len(tags)))),
+            updated_at
+        ))
+
+    return folders, folder_colors, tags, notes
+
+
+def username_for(index):
+    return NAMED_USERS[index] if index < len(NAMED_USERS) else f'user_{index}'
+
+
+class BulkWriter:
+    """Collects rows per table and writes them with executemany in batches"""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        rows = self.pending.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Parents first, the note_tags triggers look up the note's user
+        for model in (User, Folder, Tag, Note, NoteTag):
+            rows = self.pending.pop(model, [])
+            if rows:
+                db.session.execute(db.insert(model), rows)
+                self.counts[model] = self.counts.get(model, 0) + len(rows)
+
+
+def seed_database(options):
     """Main function to seed the database"""
     print("\n" + "="*50)
     print("SEEDING DATABASE")
     print("="*50 + "\n")
-    
+
+    started = time.perf_counter()
+
     with app.app_context():
+        # Every user shares a password, so hash it once
+        password_hash = password_hasher.hash(PASSWORD)
+        db.session.execute(db.text('PRAGMA synchronous = OFF'))
+
+        # sqlite3 commits DDL right away unless a transaction is already open,
+        # so open one by hand: a failed run then rolls back to the old triggers
+        db.session.execute(db.text('BEGIN'))
+        triggers = suspend_triggers()
         clear_database()
-        users = create_users()
-        folders = create_folders(users)
-        tags = create_tags(users)
-        notes = create_notes(users, folders, tags)
-        
+
+        writer = BulkWriter(options['batch_size'])
+        folder_id = tag_id = note_id = 0
+        tasks = ((index, options) for index in range(options['users']))
+
+        pool = Pool(options['processes']) if options['processes'] > 1 else None
+        results = pool.imap(generate_user, tasks, chunksize=4) if pool else map(generate_user, tasks)
+
+        print("Creating users, folders, tags and notes...")
+        for user_index, (folders, colors, tags, notes) in enumerate(results):
+            user_id = user_index + 1
+            username = username_for(user_index)
+            writer.add(User, {
+                'id': user_id,
+                'username': username,
+                'email': f'{username}@example.com',
+                '_password_hash': password_hash
+            })
+
+            first_folder = folder_id + 1
+            for name, color in zip(folders, colors):
+                folder_id += 1
+                writer.add(Folder, {'id': folder_id, 'name': name, 'color': color, 'user_id': user_id})
+
+            first_tag = tag_id + 1
+            for name in tags:
+                tag_id += 1
+                writer.add(Tag, {'id': tag_id, 'name': name, 'user_id': user_id})
+
+            for title, content, folder_index, tag_indexes, updated_at in notes:
+                note_id += 1
+                writer.add(Note, {
+                    'id': note_id,
+                    'title': title,
+                    'content': content,
+                    **Note.summarize(content),
+                    'folder_id': first_folder + folder_index,
+                    'user_id': user_id,
+                    'created_at': updated_at,
+                    'updated_at': updated_at
+                })
+                for tag_index in tag_indexes:
+                    writer.add(NoteTag, {'note_id': note_id, 'tag_id': first_tag + tag_index})
+
+            if user_id % 1000 == 0:
+                print(f"  {user_id} users, {note_id} notes")
+
+        if pool:
+            pool.close()
+            pool.join()
+
+        writer.flush()
+        rebuild_derived_data()
+        restore_triggers(triggers)
+        db.session.commit()
+
+        elapsed = time.perf_counter() - started
         print("\n" + "="*50)
         print("DATABASE SEEDING COMPLETE!")
         print("="*50)
         print(f"\nSummary:")
-        print(f"  Users: {len(users)}")
-        print(f"  Folders: {len(folders)}")
-        print(f"  Tags: {len(tags)}")
-        print(f"  Notes: {len(notes)}")
+        print(f"  Users: {writer.counts.get(User, 0)}")
+        print(f"  Folders: {writer.counts.get(Folder, 0)}")
+        print(f"  Tags: {writer.counts.get(Tag, 0)}")
+        print(f"  Notes: {writer.counts.get(Note, 0)}")
+        print(f"  Note tags: {writer.counts.get(NoteTag, 0)}")
+        print(f"  Took {elapsed:.1f}s")
         print(f"\nTest Login Credentials:")
-        print(f"  Username: alice_wonder")
-        print(f"  Password: password123")
-        print(f"\n  (All users have password: password123)")
+        print(f"  Username: {username_for(0)}")
+        print(f"  Password: {PASSWORD}")
+        print(f"\n  (All users have password: {PASSWORD})")
         print("="*50 + "\n")
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Fill the database with generated users and notes')
+    parser.add_argument('--users', type=int, default=5, help='number of users (default 5)')
+    parser.add_argument('--notes-per-user', default='5-10', help='notes per user, a number or a range like 5-10')
+    parser.add_argument('--folders-per-user', default='2-3', help='folders per user, a number or a range')
+    parser.add_argument('--tags-per-user', default='3-5', help='tags per user, a number or a range')
+    parser.add_argument('--content-words', type=int, default=120, help='median words per note (default 120)')
+    parser.add_argument('--content-sigma', type=float, default=0.8,
+                        help='spread of the log-normal note length distribution (default 0.8)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, the same seed gives the same data')
+    parser.add_argument('--faker', action='store_true', help='use Faker sentences instead of the fast word list')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes for generating content')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per bulk insert')
+    args = parser.parse_args(argv)
+
+    return {
+        'users': args.users,
+        'notes': parse_range(args.notes_per_user),
+        'folders': parse_range(args.folders_per_user),
+        'tags': parse_range(args.tags_per_user),
+        'content_words': args.content_words,
+        'content_sigma': args.content_sigma,
+        'seed': args.seed,
+        'faker': args.faker,
+        'processes': args.processes,
+        'batch_size': args.batch_size
+    }
+
+
 if __name__ == '__main__':
-    seed_database()
+    seed_database(parse_args())